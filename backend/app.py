@@ -6,6 +6,13 @@ from pymongo import MongoClient
 from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
 import certifi
+from serializers import JSONProvider
+from metrics import init_metrics
+from dbmonitor import CommandMonitor, POOL, init_db_monitoring
+from db import LazyDatabase, DatabaseUnavailable, is_production, pool_options
+from leaderboard import LEADERBOARD
+from ledger import Compactor
+from errors import ApiError
 
 load_dotenv()
 
@@ -21,10 +28,14 @@ def _init_db():
     mongo_db = os.getenv("MONGO_DB")
     
     # Check if we're in production (Render environment)
-    is_production = os.getenv("RENDER", False) or os.getenv("PYTHON_ENV") == "production"
+    production = is_production()
+
+    # Command timing / slow-query log and pool instrumentation for every client created below
+    listeners = [CommandMonitor(slow_ms=float(os.getenv("MONGO_SLOW_MS", 100))), POOL]
+    pool = pool_options(production)
 
     # Create client with explicit TLS settings for MongoDB Atlas
-    if is_production:
+    if production:
         # Production configuration for Render
         client = MongoClient(
             mongo_uri,
@@ -33,10 +44,9 @@ def _init_db():
             socketTimeoutMS=20000,
             retryWrites=True,
             retryReads=True,
-            maxPoolSize=10,
-            minPoolSize=1,
             maxIdleTimeMS=30000,
-            waitQueueTimeoutMS=5000
+            event_listeners=listeners,
+            **pool
         )
     else:
         # Development configuration with explicit TLS
@@ -51,8 +61,8 @@ def _init_db():
             socketTimeoutMS=20000,
             retryWrites=True,
             retryReads=True,
-            maxPoolSize=10,
-            minPoolSize=1
+            event_listeners=listeners,
+            **pool
         )
 
     # Test the connection
@@ -64,9 +74,9 @@ def _init_db():
         # Try alternative connection method
         try:
             print("Attempting alternative connection method...")
-            if is_production:
+            if production:
                 # Try with minimal configuration for production
-                client = MongoClient(mongo_uri)
+                client = MongoClient(mongo_uri, event_listeners=listeners, **pool)
             else:
                 # Try with different TLS settings for development
                 client = MongoClient(
@@ -75,7 +85,9 @@ def _init_db():
                     tlsInsecure=True,
                     serverSelectionTimeoutMS=10000,
                     connectTimeoutMS=10000,
-                    socketTimeoutMS=10000
+                    socketTimeoutMS=10000,
+                    event_listeners=listeners,
+                    **pool
                 )
             client.admin.command('ping')
             print("✓ Alternative MongoDB connection successful!")
@@ -95,12 +107,34 @@ def _init_db():
 
 def create_app():
     app = Flask(__name__, static_folder=None)
+    app.json = JSONProvider(app)
 
     # Config
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "dev-secret-change-me")
     app.config["UPLOAD_DIR"] = os.getenv("UPLOAD_DIR", "uploads")
     app.config["CERT_DIR"] = os.getenv("CERT_DIR", "certs")
     app.config["FRONTEND_DIR"] = os.getenv("FRONTEND_DIR", os.path.join(os.getcwd(), "frontend", "dist"))
+    app.config["STREAM_BATCH_SIZE"] = int(os.getenv("STREAM_BATCH_SIZE", 500))
+    app.config["MONGO_LAZY_CONNECT"] = os.getenv("MONGO_LAZY_CONNECT", "true").lower() == "true"
+    # set by gunicorn.conf.py when preloading: workers connect after fork
+    app.config["MONGO_DEFER_CONNECT"] = os.getenv("MONGO_DEFER_CONNECT", "false").lower() == "true"
+    app.config["MONGO_CONNECT_WAIT"] = float(os.getenv("MONGO_CONNECT_WAIT", 30))
+    app.config["AUTO_INDEXES"] = os.getenv("AUTO_INDEXES", "true").lower() == "true"
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+    app.config["MONGO_ADMISSION_MAX_WAITERS"] = int(os.getenv("MONGO_ADMISSION_MAX_WAITERS", 0))
+    app.config["MONGO_ADMISSION_RETRY_AFTER"] = int(os.getenv("MONGO_ADMISSION_RETRY_AFTER", 1))
+    app.config["DASHBOARD_WORKERS"] = int(os.getenv("DASHBOARD_WORKERS", 8))
+    app.config["BATCH_MAX_REQUESTS"] = int(os.getenv("BATCH_MAX_REQUESTS", 20))
+    app.config["BATCH_WORKERS"] = int(os.getenv("BATCH_WORKERS", 8))
+    app.config["LEADERBOARD_SIZE"] = int(os.getenv("LEADERBOARD_SIZE", 20))
+    app.config["LEADERBOARD_TTL"] = float(os.getenv("LEADERBOARD_TTL", 30))
+    app.config["LEDGER_COMPACT_INTERVAL"] = float(os.getenv("LEDGER_COMPACT_INTERVAL", 1))
+    app.config["LEDGER_COMPACT_BATCH"] = int(os.getenv("LEDGER_COMPACT_BATCH", 500))
+    app.config["SYNC_OVERLAP"] = float(os.getenv("SYNC_OVERLAP", 5))
+    app.config["CERT_WORKERS"] = int(os.getenv("CERT_WORKERS", 2))
+    app.config["CERT_RENDER_WAIT"] = float(os.getenv("CERT_RENDER_WAIT", 0.5))
+    app.config["CERT_EXPORT_WORKERS"] = int(os.getenv("CERT_EXPORT_WORKERS", os.cpu_count() or 1))
+    app.config["DB_TIMING_HEADERS"] = os.getenv("DB_TIMING_HEADERS", str(not is_production())).lower() == "true"
 
     # CORS Configuration
     cors_origins = os.getenv("CORS_ORIGINS", "*")
@@ -112,35 +146,71 @@ def create_app():
     CORS(app, 
          resources={r"/api/*": {"origins": allowed_origins}},
          supports_credentials=True,
-         allow_headers=["Content-Type", "Authorization"],
+         allow_headers=["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since", "Idempotency-Key"],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-         expose_headers=["Content-Type", "Authorization"])
+         expose_headers=["Content-Type", "Authorization", "X-DB-Queries", "Server-Timing", "ETag", "Last-Modified",
+                         "Retry-After"])
 
     JWTManager(app)
+    LEADERBOARD.configure(app.config["LEADERBOARD_SIZE"], app.config["LEADERBOARD_TTL"])
+    init_metrics(app)
+    init_db_monitoring(app)
 
     os.makedirs(app.config["UPLOAD_DIR"], exist_ok=True)
     os.makedirs(app.config["CERT_DIR"], exist_ok=True)
 
-    # DB
-    try:
+    # DB: connect (and bootstrap indexes) in the background so the app can
+    # serve /health/live immediately; app.db waits for that attempt on first use
+    def connect():
         client, db = _init_db()
-        app.db_client = client
-        app.db = db
-    except Exception as e:
-        print(f"Failed to initialize database: {e}")
-        # You might want to exit here or handle it differently
-        raise
+        # Indexes (also available as `python indexes.py [--dry-run]`)
+        if app.config["AUTO_INDEXES"]:
+            from indexes import ensure_indexes
+            try:
+                ensure_indexes(db)
+            except PyMongoError as e:
+                print(f"✗ Index bootstrap failed: {e}")
+        return client, db
+
+    app.db = LazyDatabase(connect, wait=app.config["MONGO_CONNECT_WAIT"])
+    # folds points ledger entries into users.points (see ledger.py)
+    app.ledger = Compactor(lambda: app.db, app.config["LEDGER_COMPACT_INTERVAL"],
+                           app.config["LEDGER_COMPACT_BATCH"], LEADERBOARD.update)
+    if not app.config["MONGO_DEFER_CONNECT"]:
+        app.db.start()
+        app.ledger.start()
+    if not app.config["MONGO_LAZY_CONNECT"]:
+        try:
+            app.db.join()
+        except DatabaseUnavailable as e:
+            print(f"Failed to initialize database: {e}")
+            raise
+
+    @app.errorhandler(DatabaseUnavailable)
+    def db_unavailable(e):
+        return jsonify(msg="database unavailable, please retry"), 503, {"Retry-After": "5"}
+
+    # raised by the route logic shared with asgi.py
+    @app.errorhandler(ApiError)
+    def api_error(e):
+        return jsonify(e.body()), e.status
 
     # Blueprints
     from blueprints.auth import bp as auth_bp
     from blueprints.recommendation import bp as reco_bp
     from blueprints.compliance import bp as comp_bp
     from blueprints.gamification import bp as game_bp
+    from blueprints.dashboard import bp as dash_bp
+    from blueprints.batch import bp as batch_bp
+    from blueprints.sync import bp as sync_bp
 
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(reco_bp, url_prefix="/api")
     app.register_blueprint(comp_bp, url_prefix="/api")
     app.register_blueprint(game_bp, url_prefix="/api")
+    app.register_blueprint(dash_bp, url_prefix="/api")
+    app.register_blueprint(batch_bp, url_prefix="/api")
+    app.register_blueprint(sync_bp, url_prefix="/api")
 
     # File serving
     @app.get("/uploads/<path:filename>")
@@ -151,14 +221,23 @@ def create_app():
     def serve_cert(filename):
         return send_from_directory(app.config["CERT_DIR"], filename, as_attachment=False)
 
-    # Health
+    # Health: liveness never touches the DB, readiness never waits for it
+    @app.get("/health/live")
+    def health_live():
+        return jsonify(ok=True)
+
     @app.get("/health")
+    @app.get("/health/ready")
     def health():
+        if not app.db.ready:
+            app.db.start()  # no-op while an attempt is running
+            state = "down" if app.db.error else "connecting"
+            return jsonify(ok=False, db=state, error=str(app.db.error or "")), 503
         try:
             app.db.command("ping")
             return jsonify(ok=True, db="up")
         except PyMongoError as e:
-            return jsonify(ok=False, db="down", error=str(e)), 500
+            return jsonify(ok=False, db="down", error=str(e)), 503
 
     # Root endpoint - API info instead of frontend
     @app.get("/")
@@ -169,10 +248,14 @@ def create_app():
             "version": "1.0.0",
             "endpoints": {
                 "health": "/health",
+                "metrics": "/metrics",
                 "auth": "/api/auth",
                 "recommendations": "/api/recommendations",
                 "compliance": "/api/compliance",
-                "gamification": "/api/gamification"
+                "gamification": "/api/gamification",
+                "dashboard": "/api/dashboard",
+                "batch": "/api/batch",
+                "sync": "/api/sync"
             }
         })
 
@@ -198,7 +281,10 @@ def create_app():
     return app
 
 
-app = create_app()
+# LocalProcessPool workers are spawned: they re-run the script that started
+# the process (`python app.py`) as __mp_main__, and only render certificates
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
@@ -0,0 +1,717 @@
+"""
+ASGI serving mode for the API blueprints.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Serves the auth, recommendation, compliance and gamification routes with
+the same paths, payloads and JWTs as the Flask app (a token issued by
+either is accepted by both). Views are coroutines; conditional GETs and
+the list endpoints read through motor, so one process keeps many slow
+requests in flight instead of pinning a worker per request. What a route
+does beyond that is the blueprint's own function (auth.create_user,
+compliance.approve_report, gamification.redeem, sync_queries, ...), which
+call() runs against motor's underlying pymongo database: this module only
+parses requests and wraps responses, so the two apps cannot drift apart.
+Those calls get their own thread pool of ASGI_DB_THREADS threads (default:
+MONGO_MAX_POOL_SIZE, one per pooled connection), so database work is not
+capped by the default executor's cpu + 4 threads, which other blocking work
+(PDF rendering, file writes) keeps using.
+
+Against a local mongod:
+
+    MONGO_URI=mongodb://localhost:27017/verdantia uvicorn asgi:app
+"""
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from urllib.parse import unquote
+
+import certifi
+import jwt
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import PyMongoError
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse, FileResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.security import safe_join
+
+import serializers
+from serializers import REPORT_FIELDS, UPLOAD_FIELDS, VOUCHER_FIELDS
+from pagination import page_args, after, sort_spec, encode_cursor
+from streaming import wants_stream, NDJSON
+from dbmonitor import CommandMonitor, POOL
+from db import is_production, pool_options
+from indexes import ensure_indexes
+from errors import ApiError
+from blueprints import auth, compliance, gamification
+from blueprints.dashboard import dashboard_queries, dashboard_payload
+from blueprints.sync import parse_since, sync_queries, sync_payload
+from blueprints.recommendation import recommend
+from blueprints.batch import parse_batch, runs, SUBREQUEST
+import certificates
+import ledger
+import versions
+from leaderboard import LEADERBOARD, decode_position, bucket_start
+
+load_dotenv()
+
+JWT_SECRET = os.getenv("JWT_SECRET_KEY", "dev-secret-change-me")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+CERT_DIR = os.getenv("CERT_DIR", "certs")
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", 20))
+AUTO_INDEXES = os.getenv("AUTO_INDEXES", "true").lower() == "true"
+LEADERBOARD.configure(int(os.getenv("LEADERBOARD_SIZE", 20)), float(os.getenv("LEADERBOARD_TTL", 30)))
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", 1))
+LEDGER_COMPACT_BATCH = int(os.getenv("LEDGER_COMPACT_BATCH", 500))
+SYNC_OVERLAP = float(os.getenv("SYNC_OVERLAP", 5))
+CERT_RENDER_WAIT = float(os.getenv("CERT_RENDER_WAIT", 0.5))
+CERT_EXPORT_WORKERS = int(os.getenv("CERT_EXPORT_WORKERS", os.cpu_count() or 1))
+MONGO_POOL = pool_options(is_production())
+ASGI_DB_THREADS = int(os.getenv("ASGI_DB_THREADS", MONGO_POOL["maxPoolSize"]))
+_export_pool = None
+
+
+# --------------------------
+# Helpers
+# --------------------------
+
+def _accept(request):
+    return parse_accept_header(request.headers.get("accept"), MIMEAccept)
+
+
+def respond(request, obj, status=200):
+    """JSON / MessagePack response, negotiated like JSONProvider.response()"""
+    mimetype = serializers.response_mimetype(_accept(request))
+    resp = Response(serializers.encode(obj, mimetype), status_code=status, media_type=mimetype)
+    resp.headers["Vary"] = "Accept"
+    return resp
+
+
+async def _json(request):
+    body = await request.body()
+    if not body:
+        return {}
+    try:
+        return (serializers.orjson or json).loads(body)
+    except ValueError:
+        raise ApiError(400, "invalid JSON body")
+
+
+def issue_token(user_id, role, username):
+    """Access token with the same claims flask_jwt_extended puts in create_access_token()"""
+    now = datetime.now(timezone.utc)
+    return jwt.encode({
+        "fresh": False, "iat": now, "jti": str(uuid.uuid4()), "type": "access",
+        "sub": user_id, "nbf": now, "exp": now + timedelta(days=1),
+        "role": role, "username": username,
+    }, JWT_SECRET, algorithm="HS256")
+
+
+def decode_token(token):
+    claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    if claims.get("type") != "access":
+        raise jwt.InvalidTokenError("Only non-refresh tokens are allowed")
+    return claims
+
+
+def claims_of(request):
+    """Claims of the Bearer token, with flask_jwt_extended's error responses."""
+    auth = request.headers.get("authorization", "")
+    if not auth.startswith("Bearer "):
+        raise ApiError(401, "Missing Authorization Header")
+    try:
+        return decode_token(auth.split(" ", 1)[1].strip())
+    except jwt.ExpiredSignatureError:
+        raise ApiError(401, "Token has expired")
+    except jwt.InvalidTokenError as e:
+        raise ApiError(422, str(e))
+
+
+def government(request):
+    claims = claims_of(request)
+    if claims.get("role") != "government":
+        raise ApiError(403, "forbidden")
+    return claims
+
+
+def _upload_base(request):
+    return f"{request.base_url}uploads/"
+
+
+def _upload_serializer(request):
+    base = _upload_base(request)
+    return lambda d: serializers.upload(d, base)
+
+
+def blocking(request, fn, *args):
+    """Future of fn(*args) on the database thread pool (see lifespan())"""
+    return asyncio.get_running_loop().run_in_executor(request.app.state.db_threads, fn, *args)
+
+
+async def call(request, fn, *args):
+    """
+    fn(db, *args), route logic shared with the blueprints, on a database
+    thread with motor's underlying pymongo database
+    """
+    return await blocking(request, fn, request.app.state.db.delegate, *args)
+
+
+def build(request, fn, *args):
+    """conditional() build of the response of call(request, fn, *args)"""
+    async def run():
+        return respond(request, await call(request, fn, *args))
+    return run
+
+
+async def gather(request, queries):
+    """Results of {name: query function} (dashboard_queries(), sync_queries()), run concurrently"""
+    results = await asyncio.gather(*(blocking(request, fn) for fn in queries.values()))
+    return dict(zip(queries, results))
+
+
+async def stream(request, chunks):
+    """A blocking generator of response chunks (export_chunks(), summary_chunks()), run on database threads"""
+    try:
+        while True:
+            chunk = await blocking(request, next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # still running on its thread if the client went away: garbage collection closes it
+        with contextlib.suppress(ValueError):
+            chunks.close()
+
+
+async def list_response(request, collection, query, key, serialize, direction=-1,
+                        streamable=False, fields=None):
+    """Async counterpart of pagination.list_response()"""
+    try:
+        page = page_args(request.query_params)
+    except ValueError as e:
+        return respond(request, {"msg": str(e)}, 400)
+
+    limit, position = page or (0, None)
+    if position:
+        query = {"$and": [query, after(*position, direction)]}
+    cursor = collection.find(query, fields).sort(sort_spec(direction))
+
+    if streamable and wants_stream(request.query_params, _accept(request)):
+        cursor = cursor.limit(limit).batch_size(STREAM_BATCH_SIZE)
+
+        async def lines():
+            async for doc in cursor:
+                yield serializers.encode(serialize(doc)) + b"\n"
+
+        return StreamingResponse(lines(), media_type=NDJSON, headers={"X-Accel-Buffering": "no"})
+
+    if page is None:
+        return respond(request, {key: [serialize(d) async for d in cursor]})
+
+    docs = await cursor.limit(limit + 1).to_list(None)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return respond(request, {key: [serialize(d) for d in docs[:limit]], "next_cursor": next_cursor})
+
+
+async def conditional(request, keys, build, variant="", since=None):
+    """Counterpart of versions.conditional(); build is a coroutine function"""
+    docs = await request.app.state.db.versions.find({"_id": {"$in": keys}}).to_list(None)
+    token, last_modified = versions.state(docs, keys, since)
+    return await conditional_response(request, f"{token}|{variant}", last_modified, build)
+
+
+async def conditional_response(request, token, last_modified, build):
+    tag = versions.etag(token, request.url.path, request.url.query, request.headers.get("accept"))
+    if versions.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"),
+                             tag, last_modified):
+        resp = Response(status_code=304)
+    else:
+        resp = await build()
+        if resp.status_code != 200:
+            return resp
+    resp.headers.update(versions.validators(tag, last_modified))
+    resp.headers["Vary"] = ", ".join(versions.VARY)
+    return resp
+
+
+# --------------------------
+# Auth
+# --------------------------
+
+async def register(request):
+    u = await call(request, auth.create_user, await _json(request))
+    return respond(request, {"ok": True, "user": serializers.user(u)}, 201)
+
+
+async def login(request):
+    data = await _json(request)
+    username = data.get("username")
+    u = await call(request, auth.authenticate, username, data.get("password"))
+    token = issue_token(str(u["_id"]), u.get("role", "user"), username)
+    return respond(request, {"token": token, "user": serializers.user(u)})
+
+
+async def me(request):
+    uid = claims_of(request)["sub"]
+    return await conditional(request, [versions.key("users", uid)], build(request, auth.profile, uid))
+
+
+# --------------------------
+# Recommendation
+# --------------------------
+
+async def recommendation(request):
+    claims_of(request)
+    return respond(request, recommend(await _json(request)))
+
+
+# --------------------------
+# Compliance
+# --------------------------
+
+async def compliance_check(request):
+    claims = claims_of(request)
+    doc = await call(request, compliance.submit_report, await _json(request), claims["sub"],
+                     claims.get("username", "user"))
+    return respond(request, serializers.report(doc), 201)
+
+
+async def my_reports(request):
+    uid = ObjectId(claims_of(request)["sub"])
+    return await conditional(request, [versions.key("reports", uid)], lambda: list_response(
+        request, request.app.state.db.reports, {"user_id": uid}, "reports",
+        serializers.report, -1, fields=REPORT_FIELDS))
+
+
+async def delete_compliance_report(request):
+    uid = ObjectId(claims_of(request)["sub"])
+    return respond(request, await call(request, compliance.delete_report, uid, request.path_params["rid"]))
+
+
+async def admin_pending(request):
+    government(request)
+    return await conditional(request, [versions.key("reports", "pending")], lambda: list_response(
+        request, request.app.state.db.reports, {"status": "Pending"}, "reports",
+        serializers.report, 1, streamable=True, fields=REPORT_FIELDS))
+
+
+async def approve(request):
+    government(request)
+    d = await call(request, compliance.approve_report, request.path_params["rid"])
+    if d:
+        # render the certificate ahead of its first download (see certificates.py)
+        loop = asyncio.get_running_loop()
+        certificates.JOBS.start(certificates.certificate_key(d, JWT_SECRET), lambda: loop.run_in_executor(
+            None, certificates.cached, d, CERT_DIR, JWT_SECRET))
+    return respond(request, {"ok": True})
+
+
+def download_claims(request):
+    """(claims, None) from the Bearer token or ?token=, else (None, error response)"""
+    token = None
+    header = request.headers.get("authorization", "")
+    if header.startswith("Bearer "):
+        token = header.split(" ", 1)[1].strip()
+    if not token:
+        token = request.query_params.get("token")
+    if not token:
+        return None, respond(request, {"msg": "Missing Authorization Header"}, 401)
+    try:
+        return decode_token(token), None
+    except jwt.InvalidTokenError:
+        return None, respond(request, {"msg": "invalid token"}, 401)
+
+
+async def certificate(request):
+    rid = request.path_params["rid"]
+    claims, error = download_claims(request)
+    if error:
+        return error
+    report = await call(request, compliance.certificate_report, rid, claims)
+
+    disposition = {"Content-Disposition": f'attachment; filename="certificate_{rid}.pdf"'}
+    if report.get("status") == "Approved":
+        job = certificates.JOBS.get(certificates.certificate_key(report, JWT_SECRET))
+        if job is not None:
+            done, _ = await asyncio.wait({job}, timeout=CERT_RENDER_WAIT)
+            if not done:
+                resp = respond(request, {"msg": "certificate is being generated, please retry"}, 202)
+                resp.headers["Retry-After"] = "1"
+                return resp
+        name, etag = await asyncio.to_thread(certificates.cached, report, CERT_DIR, JWT_SECRET)
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if versions.not_modified(request.headers.get("if-none-match"), None, etag, None):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(os.path.join(CERT_DIR, name), media_type="application/pdf",
+                            headers={**headers, **disposition})
+
+    buf = BytesIO()
+    await asyncio.to_thread(certificates.draw_certificate, buf, report)
+    return Response(buf.getvalue(), media_type="application/pdf", headers=disposition)
+
+
+def export_pool():
+    """Process pool rendering export certificates, spawned (see workers.LocalProcessPool)"""
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(CERT_EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _export_pool
+
+
+async def export_certificates(request):
+    claims, error = download_claims(request)
+    if error:
+        return error
+    _, query, field = compliance.report_filter(claims, request.query_params, "Approved")
+    chunks = compliance.export_chunks(request.app.state.db.delegate, query, field, STREAM_BATCH_SIZE,
+                                      CERT_DIR, JWT_SECRET, export_pool().submit, 2 * CERT_EXPORT_WORKERS)
+    return StreamingResponse(stream(request, chunks), media_type="application/zip", headers={
+        "Content-Disposition": "attachment; filename=certificates.zip", "X-Accel-Buffering": "no"})
+
+
+async def compliance_summary(request):
+    claims, error = download_claims(request)
+    if error:
+        return error
+    filters, query, field = compliance.report_filter(claims, request.query_params)
+    chunks = compliance.summary_chunks(request.app.state.db.delegate, query, field, STREAM_BATCH_SIZE, filters)
+    return StreamingResponse(stream(request, chunks), media_type="application/pdf", headers={
+        "Content-Disposition": "attachment; filename=compliance_summary.pdf", "X-Accel-Buffering": "no"})
+
+
+# --------------------------
+# Gamification
+# --------------------------
+
+def _save(src, path):
+    with open(path, "wb") as out:
+        shutil.copyfileobj(src, out)
+
+
+async def upload_video(request):
+    uid = claims_of(request)["sub"]
+    form = await request.form()
+    f = form.get("file")
+    if not f or not getattr(f, "filename", None):
+        return respond(request, {"msg": "file required"}, 400)
+    safe = gamification.upload_filename(uid, f.filename)
+    if not safe:
+        return respond(request, {"msg": "invalid file type"}, 400)
+    await asyncio.to_thread(_save, f.file, os.path.join(UPLOAD_DIR, safe))
+    doc = await call(request, gamification.add_upload, uid, safe)
+    return respond(request, _upload_serializer(request)(doc))
+
+
+async def my_videos(request):
+    uid = ObjectId(claims_of(request)["sub"])
+    return await conditional(request, [versions.key("uploads", uid)], lambda: list_response(
+        request, request.app.state.db.uploads, {"user_id": uid}, "videos",
+        _upload_serializer(request), -1, fields=UPLOAD_FIELDS))
+
+
+async def delete_upload_video(request):
+    uid = ObjectId(claims_of(request)["sub"])
+    return respond(request, await call(request, gamification.delete_upload, uid, request.path_params["uidoc"],
+                                       UPLOAD_DIR))
+
+
+async def admin_uploads_pending(request):
+    government(request)
+    return await conditional(request, [versions.key("uploads", "pending")], lambda: list_response(
+        request, request.app.state.db.uploads, {"status": "Pending"}, "uploads",
+        _upload_serializer(request), 1, streamable=True, fields=UPLOAD_FIELDS))
+
+
+async def upload_approve(request):
+    government(request)
+    await call(request, gamification.approve_upload, request.path_params["uidoc"])
+    return respond(request, {"ok": True})
+
+
+async def leaderboard(request):
+    period = request.query_params.get("period", "all")
+    if period != "all":
+        now = datetime.utcnow()
+        start = gamification.window_start(period, request.query_params.get("ago"), now)
+        return await conditional(request, [versions.key("users")],
+                                 build(request, gamification.window_board, period, start),
+                                 start.isoformat(), bucket_start(period, now))
+    try:
+        page = page_args(request.query_params, decode=decode_position)
+    except ValueError as e:
+        return respond(request, {"msg": str(e)}, 400)
+    if page is None:
+        rows, tag = await call(request, gamification.leaderboard_snapshot)
+
+        async def top():
+            return respond(request, {"leaderboard": rows})
+
+        return await conditional_response(request, "board=" + tag, None, top)
+    return await conditional(request, [versions.key("users")], build(request, gamification.leaderboard_page, *page))
+
+
+async def leaderboard_me(request):
+    uid = claims_of(request)["sub"]
+    return respond(request, await call(request, gamification.rank_window, uid, request.query_params.get("around")))
+
+
+async def redeem_voucher(request):
+    uid = claims_of(request)["sub"]
+    data = await _json(request)
+    return respond(request, await call(request, gamification.redeem, uid, data.get("voucher_id"),
+                                       request.headers.get("idempotency-key")))
+
+
+async def my_vouchers(request):
+    uid = ObjectId(claims_of(request)["sub"])
+    return await conditional(request, [versions.key("vouchers", uid)], lambda: list_response(
+        request, request.app.state.db.voucher_redemptions, {"user_id": uid}, "vouchers",
+        serializers.voucher, -1, fields=VOUCHER_FIELDS))
+
+
+# --------------------------
+# Dashboard
+# --------------------------
+
+async def dashboard(request):
+    """Counterpart of blueprints/dashboard.py: the queries run concurrently on worker threads"""
+    claims = claims_of(request)
+    uid = ObjectId(claims["sub"])
+    owner = "pending" if claims.get("role") == "government" else uid
+    keys = [versions.key("users", uid), versions.key("reports", owner), versions.key("uploads", owner)]
+    _, board = await call(request, gamification.leaderboard_snapshot)
+
+    async def parts():
+        queries = dashboard_queries(request.app.state.db.delegate, claims, uid, _upload_base(request))
+        return respond(request, dashboard_payload(await gather(request, queries)))
+
+    return await conditional(request, keys, parts, "board=" + board)
+
+
+# --------------------------
+# Sync
+# --------------------------
+
+async def sync(request):
+    """Counterpart of blueprints/sync.py"""
+    claims = claims_of(request)
+    now = datetime.utcnow()
+    since = parse_since(request.query_params.get("since"), now)
+    specs, queries = sync_queries(request.app.state.db.delegate, ObjectId(claims["sub"]),
+                                  claims.get("role") == "government", since, _upload_base(request))
+    return respond(request, sync_payload(await gather(request, queries), specs, since, now, SYNC_OVERLAP))
+
+
+# --------------------------
+# Batch
+# --------------------------
+
+async def _dispatch(request, method, path, body):
+    """Run one sub-request through the app (middleware and routing included)."""
+    path, _, query = path.partition("?")
+    headers = [(b"accept", serializers.JSON.encode())]
+    if request.headers.get("authorization"):
+        headers.append((b"authorization", request.headers["authorization"].encode()))
+    payload = b""
+    if body is not None:
+        payload = serializers.encode(body)
+        headers.append((b"content-type", serializers.JSON.encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": request.url.scheme, "server": request.scope.get("server"),
+        "client": request.scope.get("client"), "root_path": request.scope.get("root_path", ""),
+        "path": unquote(path), "raw_path": path.encode(), "query_string": query.encode(), "headers": headers,
+        SUBREQUEST: True,
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()  # never disconnects
+
+    start, chunks = {}, []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await request.app(scope, receive, send)
+    content_type = dict(start.get("headers", [])).get(b"content-type", b"").decode().split(";")[0]
+    out = {"status": start.get("status", 500)}
+    if content_type == serializers.JSON:
+        out["body"] = json.loads(b"".join(chunks) or b"null")
+    else:
+        out["body"] = None
+        out["content_type"] = content_type
+    return out
+
+
+async def batch(request):
+    """Counterpart of blueprints/batch.py"""
+    claims_of(request)
+    if request.scope.get(SUBREQUEST):
+        return respond(request, {"msg": "batches cannot be nested"}, 400)
+    try:
+        subs, parallel = parse_batch(await _json(request), BATCH_MAX_REQUESTS)
+    except ValueError as e:
+        return respond(request, {"msg": str(e)}, 400)
+
+    results = []
+    for run in runs(subs, parallel):
+        results.extend(await asyncio.gather(*(_dispatch(request, *sub) for sub in run)))
+    return respond(request, {"responses": results})
+
+
+# --------------------------
+# Files / health
+# --------------------------
+
+def _file(directory):
+    async def serve(request):
+        path = safe_join(directory, request.path_params["filename"])
+        if path is None or not os.path.isfile(path):
+            return respond(request, {"error": "Not found"}, 404)
+        return FileResponse(path)
+    return serve
+
+
+async def health_live(request):
+    return respond(request, {"ok": True})
+
+
+async def health_ready(request):
+    try:
+        await request.app.state.db.command("ping")
+        return respond(request, {"ok": True, "db": "up"})
+    except PyMongoError as e:
+        return respond(request, {"ok": False, "db": "down", "error": str(e)}, 503)
+
+
+async def api_error(request, exc):
+    return respond(request, exc.body(), exc.status)
+
+
+# --------------------------
+# App
+# --------------------------
+
+def _bootstrap_indexes(db):
+    try:
+        ensure_indexes(db)
+    except PyMongoError as e:
+        print(f"✗ Index bootstrap failed: {e}")
+
+
+async def _compact_forever(db, threads):
+    """ledger.Compactor's loop, on a database thread with motor's underlying pymongo client"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        try:
+            await loop.run_in_executor(threads, ledger.compact, db, LEDGER_COMPACT_BATCH, LEADERBOARD.update)
+        except PyMongoError as e:
+            print(f"✗ Ledger compaction failed: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # motor connects lazily: startup never blocks on server selection
+    uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/verdantia")
+    tls = {"tlsCAFile": certifi.where()} if uri.startswith("mongodb+srv://") else {}
+    client = AsyncIOMotorClient(
+        uri,
+        serverSelectionTimeoutMS=30000,
+        connectTimeoutMS=20000,
+        socketTimeoutMS=20000,
+        retryWrites=True,
+        retryReads=True,
+        event_listeners=[CommandMonitor(slow_ms=float(os.getenv("MONGO_SLOW_MS", 100))), POOL],
+        **MONGO_POOL,
+        **tls,
+    )
+    mongo_db = os.getenv("MONGO_DB")
+    app.state.db = client[mongo_db] if mongo_db else client.get_default_database("verdantia")
+    # call(), gather() and stream() run pymongo here rather than in the default executor
+    app.state.db_threads = ThreadPoolExecutor(ASGI_DB_THREADS, thread_name_prefix="asgi-db")
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(CERT_DIR, exist_ok=True)
+    if AUTO_INDEXES:
+        # sync pymongo on motor's underlying client, off the event loop
+        app.state.indexes = asyncio.get_running_loop().run_in_executor(
+            app.state.db_threads, _bootstrap_indexes, app.state.db.delegate)
+    compactor = asyncio.create_task(_compact_forever(app.state.db.delegate, app.state.db_threads))
+    yield
+    compactor.cancel()
+    app.state.db_threads.shutdown(wait=False, cancel_futures=True)
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+    client.close()
+
+
+routes = [
+    Route("/api/auth/register", register, methods=["POST"]),
+    Route("/api/auth/login", login, methods=["POST"]),
+    Route("/api/auth/me", me, methods=["GET"]),
+    Route("/api/recommendation", recommendation, methods=["POST"]),
+    Route("/api/compliance-check", compliance_check, methods=["POST"]),
+    Route("/api/compliance-reports", my_reports, methods=["GET"]),
+    Route("/api/compliance-report/{rid}", delete_compliance_report, methods=["DELETE"]),
+    Route("/api/admin/compliance-pending", admin_pending, methods=["GET"]),
+    Route("/api/compliance-approve/{rid}", approve, methods=["PUT"]),
+    Route("/api/compliance-certificate/{rid}", certificate, methods=["GET"]),
+    Route("/api/admin/certificates-export", export_certificates, methods=["GET"]),
+    Route("/api/admin/compliance-summary", compliance_summary, methods=["GET"]),
+    Route("/api/upload-video", upload_video, methods=["POST"]),
+    Route("/api/my-videos", my_videos, methods=["GET"]),
+    Route("/api/upload-video/{uidoc}", delete_upload_video, methods=["DELETE"]),
+    Route("/api/admin/uploads-pending", admin_uploads_pending, methods=["GET"]),
+    Route("/api/upload-approve/{uidoc}", upload_approve, methods=["PUT"]),
+    Route("/api/leaderboard", leaderboard, methods=["GET"]),
+    Route("/api/leaderboard/me", leaderboard_me, methods=["GET"]),
+    Route("/api/redeem-voucher", redeem_voucher, methods=["POST"]),
+    Route("/api/my-vouchers", my_vouchers, methods=["GET"]),
+    Route("/api/dashboard", dashboard, methods=["GET"]),
+    Route("/api/sync", sync, methods=["GET"]),
+    Route("/api/batch", batch, methods=["POST"]),
+    Route("/uploads/{filename:path}", _file(UPLOAD_DIR), methods=["GET"]),
+    Route("/certs/{filename:path}", _file(CERT_DIR), methods=["GET"]),
+    Route("/health/live", health_live, methods=["GET"]),
+    Route("/health", health_ready, methods=["GET"]),
+    Route("/health/ready", health_ready, methods=["GET"]),
+]
+
+_origins = os.getenv("CORS_ORIGINS", "*")
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    exception_handlers={ApiError: api_error},
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["*"] if _origins == "*" else [o.strip() for o in _origins.split(",")],
+        allow_credentials=_origins != "*",
+        allow_headers=["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since", "Idempotency-Key"],
+        allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        expose_headers=["Content-Type", "Authorization", "ETag", "Last-Modified", "Retry-After"],
+    )],
+)
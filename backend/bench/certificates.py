@@ -0,0 +1,66 @@
+"""
+Certificate rendering cost, full redraw / template overlay.
+
+    cd backend && python bench/certificates.py [n_pdfs]
+
+"before" redraws the whole page with ReportLab's default ASCII85 + Flate
+streams, as certificates.draw_certificate() did; "redraw" is the same page
+with Flate only; "overlay" copies the prebuilt static page and draws the
+report's fields over it (the default). No database is needed, reports are
+generated in memory.
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from io import BytesIO
+from bson import ObjectId
+from reportlab import rl_config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import certificates  # noqa: E402
+
+
+def make_reports(n):
+    now = datetime.utcnow()
+    return [{
+        "_id": ObjectId(), "user_id": ObjectId(), "username": f"user{i}",
+        "project_name": f"Project {i}", "species_choice": "Azadirachta indica (Neem)",
+        "lat": 28.61 + i / 1e4, "lon": 77.21, "status": "Approved",
+        "approved_at": now - timedelta(minutes=i),
+    } for i in range(n)]
+
+
+def bench(reports, overlay, a85=0, repeat=5):
+    rl_config.useA85 = a85
+    sizes = []
+
+    def run():
+        sizes.clear()
+        for r in reports:
+            buf = BytesIO()
+            certificates.draw_certificate(buf, r, invariant=True, overlay=overlay)
+            sizes.append(buf.tell())
+
+    try:
+        run()  # warm up fonts / static_page()
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+    finally:
+        rl_config.useA85 = 0
+    return len(reports) / best, sum(sizes) / len(sizes)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    reports = make_reports(n)
+
+    before = bench(reports, overlay=False, a85=1)
+    redraw = bench(reports, overlay=False)
+    overlay = bench(reports, overlay=True)
+    print(f"{n} certificates, best of 5")
+    for name, (rate, size) in (("before", before), ("redraw", redraw), ("overlay", overlay)):
+        print(f"{name + ':':9}{rate:7.0f} PDFs/s {size:7.0f} bytes/PDF  ({rate / before[0]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Per-document serialization cost of the list endpoints, before / after
+serializers.py.
+
+    cd backend && python bench/serialization.py [n_docs]
+
+"before" is the previous per-blueprint helpers (url_for per upload row) with
+Flask's default JSON provider; "after" is serializers.* with JSONProvider.
+No database is needed, documents are generated in memory.
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+from bson import ObjectId
+from flask import Flask, url_for
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import serializers  # noqa: E402
+
+
+def legacy_report(doc):
+    return {
+        "id": str(doc["_id"]),
+        "user_id": str(doc["user_id"]),
+        "username": doc.get("username"),
+        "project_name": doc.get("project_name"),
+        "species_choice": doc.get("species_choice"),
+        "area_sqm": doc.get("area_sqm"),
+        "trees_planned": doc.get("trees_planned"),
+        "lat": doc.get("lat"),
+        "lon": doc.get("lon"),
+        "status": doc.get("status","Pending"),
+        "result": doc.get("result",{})
+    }
+
+
+def legacy_upload(d):
+    url = None
+    if d.get("filename"):
+        url = url_for("serve_upload", filename=d["filename"], _external=True)
+    return {
+        "id": str(d["_id"]),
+        "user_id": str(d["user_id"]),
+        "filename": d.get("filename"),
+        "status": d.get("status","Pending"),
+        "points_awarded": int(d.get("points_awarded",0)),
+        "url": url
+    }
+
+
+def make_docs(n):
+    uid = ObjectId()
+    now = datetime.utcnow()
+    reports = [{
+        "_id": ObjectId(), "user_id": uid, "username": "user1",
+        "project_name": f"Project {i}", "species_choice": "Azadirachta indica (Neem)",
+        "area_sqm": 1200.0, "trees_planned": 15, "green_area_sqm": None,
+        "lat": 28.61, "lon": 77.21, "status": "Pending",
+        "result": {"required_trees": 15, "delta_trees": 0, "compliant": True},
+        "created_at": now,
+    } for i in range(n)]
+    uploads = [{
+        "_id": ObjectId(), "user_id": uid, "filename": f"{uid}_1700000000_plot{i}.mp4",
+        "status": "Pending", "points_awarded": 0, "created_at": now,
+    } for i in range(n)]
+    return reports, uploads
+
+
+def bench(app, provider, report_fn, upload_fn, reports, uploads, repeat=5):
+    app.json = provider(app)
+
+    def run():
+        app.json.response(reports=[report_fn(d) for d in reports]).get_data()
+        app.json.response(uploads=[upload_fn(d) for d in uploads]).get_data()
+
+    with app.test_request_context("/api/admin/uploads-pending", base_url="https://api.example.org"):
+        run()  # warm up url_for / caches
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / (len(reports) + len(uploads)) * 1e6
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    app = Flask(__name__)
+    app.add_url_rule("/uploads/<path:filename>", "serve_upload", lambda filename: "")
+    reports, uploads = make_docs(n)
+
+    before = bench(app, DefaultJSONProvider, legacy_report, legacy_upload, reports, uploads)
+    after = bench(app, serializers.JSONProvider, serializers.report, serializers.upload, reports, uploads)
+    engine = "orjson" if serializers.orjson else "stdlib json"
+    print(f"{n} reports + {n} uploads, best of 5")
+    print(f"before: {before:6.2f} us/doc")
+    print(f"after:  {after:6.2f} us/doc  ({engine}, {before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,47 +3,72 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 from werkzeug.security import generate_password_hash, check_password_hash
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from serializers import user as _pub, USER_FIELDS
+from leaderboard import LEADERBOARD
+from versions import conditional, bump, key
+from errors import ApiError
 from datetime import timedelta
 
 bp = Blueprint("auth", __name__)
 
-def _pub(u):
-    return {
-        "id": str(u["_id"]),
-        "username": u.get("username"),
-        "role": u.get("role","user"),
-        "points": int(u.get("points",0))
-    }
-
-@bp.post("/register")
-def register():
-    data = request.get_json() or {}
+def new_user(data):
+    """Validate a registration and build the user document (shared with asgi.py)"""
     username = data.get("username")
     password = data.get("password")
     role = data.get("role","user")
     if role not in ["user","government"]:
         role = "user"
     if not username or not password:
-        return jsonify(msg="username & password required"), 400
-    if current_app.db.users.find_one({"username": username}):
-        return jsonify(msg="username exists"), 400
-    u = {
+        raise ValueError("username & password required")
+    return {
         "username": username,
         "password_hash": generate_password_hash(password),
         "role": role,
         "points": 0
     }
-    current_app.db.users.insert_one(u)
+
+def create_user(db, data):
+    """Register a user from the request JSON; the document, or ApiError (shared with asgi.py)"""
+    try:
+        u = new_user(data)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    if db.users.find_one({"username": u["username"]}, {"_id": 1}):
+        raise ApiError(400, "username exists")
+    try:
+        db.users.insert_one(u)
+    except DuplicateKeyError:
+        # concurrent register with the same name, caught by username_unique
+        raise ApiError(400, "username exists")
+    LEADERBOARD.update(u)
+    bump(db, key("users"))
+    return u
+
+def authenticate(db, username, password):
+    """The user with these credentials, or ApiError (shared with asgi.py)"""
+    u = db.users.find_one({"username": username})
+    if not u or not password or not check_password_hash(u.get("password_hash",""), password):
+        raise ApiError(401, "invalid credentials")
+    return u
+
+def profile(db, uid):
+    """/me payload (shared with asgi.py)"""
+    u = db.users.find_one({"_id": ObjectId(uid)}, USER_FIELDS)
+    if not u:
+        raise ApiError(404, "not found")
+    return {"user": _pub(u)}
+
+@bp.post("/register")
+def register():
+    u = create_user(current_app.db, request.get_json() or {})
     return jsonify(ok=True, user=_pub(u)), 201
 
 @bp.post("/login")
 def login():
     data = request.get_json() or {}
     username = data.get("username")
-    password = data.get("password")
-    u = current_app.db.users.find_one({"username": username})
-    if not u or not check_password_hash(u.get("password_hash",""), password):
-        return jsonify(msg="invalid credentials"), 401
+    u = authenticate(current_app.db, username, data.get("password"))
     role = u.get("role","user")
     token = create_access_token(identity=str(u["_id"]), additional_claims={"role": role, "username": username}, expires_delta=timedelta(days=1))
     return jsonify(token=token, user=_pub(u))
@@ -52,6 +77,4 @@ def login():
 @jwt_required()
 def me():
     claims = get_jwt()
-    u = current_app.db.users.find_one({"_id": ObjectId(claims["sub"])})
-    if not u: return jsonify(msg="not found"), 404
-    return jsonify(user=_pub(u))
+    return conditional([key("users", claims["sub"])], lambda: jsonify(profile(current_app.db, claims["sub"])))
@@ -0,0 +1,117 @@
+"""
+POST /api/batch: several API calls in one round trip.
+
+    {"requests": [{"method": "PUT", "path": "/api/compliance-approve/<id>"},
+                  {"method": "GET", "path": "/api/admin/compliance-pending"},
+                  {"method": "GET", "path": "/api/admin/uploads-pending"}],
+     "parallel": true}
+    -> {"responses": [{"status": 200, "body": {...}}, ...]}
+
+Sub-requests are dispatched in-process through the normal routing, hooks
+and error handlers, with the caller's Authorization header, and run in
+order. With "parallel": true, consecutive GETs run concurrently; writes
+still act as barriers, so a GET after an approve sees its result.
+"""
+from urllib.parse import unquote
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required
+from serializers import JSON
+from workers import LocalPool
+
+bp = Blueprint("batch", __name__)
+
+POOL = LocalPool("batch", "BATCH_WORKERS")
+
+METHODS = {"GET", "POST", "PUT", "DELETE"}
+
+# set in the environ (scope in asgi.py) of sub-requests: a batch inside a
+# batch would multiply the fan-out, however its path is spelled
+SUBREQUEST = "verdantia.batch"
+
+
+def validate_requests(items, limit):
+    """[(method, path, body)] from the request list, or ValueError (shared with asgi.py)"""
+    if not isinstance(items, list) or not items:
+        raise ValueError("requests must be a non-empty list")
+    if len(items) > limit:
+        raise ValueError(f"at most {limit} requests per batch")
+    subs = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"requests[{i}] must be an object")
+        method = str(item.get("method", "GET")).upper()
+        path = item.get("path") or ""
+        if method not in METHODS:
+            raise ValueError(f"requests[{i}]: unsupported method {method}")
+        if not isinstance(path, str) or not path.startswith("/api/") or unquote(path.split("?")[0]).rstrip("/") == "/api/batch":
+            raise ValueError(f"requests[{i}]: path must be an /api/ route other than /api/batch")
+        subs.append((method, path, item.get("body")))
+    return subs
+
+
+def parse_batch(data, limit):
+    """([(method, path, body)], parallel) from the request JSON, or ValueError (shared with asgi.py)"""
+    items = data.get("requests") if isinstance(data, dict) else data
+    parallel = isinstance(data, dict) and bool(data.get("parallel"))
+    return validate_requests(items, limit), parallel
+
+
+def runs(subs, parallel):
+    """
+    Sub-requests grouped as they execute, in order: a run of consecutive
+    GETs together when `parallel`, anything else alone (shared with asgi.py)
+    """
+    i = 0
+    while i < len(subs):
+        j = i + 1
+        if parallel and subs[i][0] == "GET":
+            while j < len(subs) and subs[j][0] == "GET":
+                j += 1
+        yield subs[i:j]
+        i = j
+
+
+def _dispatch(app, base_url, auth, method, path, body):
+    headers = {"Accept": JSON}
+    if auth:
+        headers["Authorization"] = auth
+    # fresh app context: sub-requests must not share the batch request's g
+    with app.app_context(), app.test_request_context(
+            path, method=method, base_url=base_url, headers=headers, json=body,
+            environ_overrides={SUBREQUEST: True}):
+        try:
+            resp = app.full_dispatch_request()
+        except Exception as e:
+            resp = app.make_response(app.handle_exception(e))
+        try:
+            out = {"status": resp.status_code}
+            if resp.mimetype == JSON and not resp.is_streamed:
+                out["body"] = resp.get_json(silent=True)
+            else:
+                out["body"] = None
+                out["content_type"] = resp.mimetype
+            return out
+        finally:
+            resp.close()
+
+
+@bp.route("/batch", methods=["POST"])
+@jwt_required()
+def batch():
+    if request.environ.get(SUBREQUEST):
+        return jsonify(msg="batches cannot be nested"), 400
+    try:
+        subs, parallel = parse_batch(request.get_json(silent=True), current_app.config["BATCH_MAX_REQUESTS"])
+    except ValueError as e:
+        return jsonify(msg=str(e)), 400
+
+    app = current_app._get_current_object()
+    args = (app, request.url_root, request.headers.get("Authorization"))
+    results = []
+    for run in runs(subs, parallel):
+        if len(run) > 1:
+            futures = [POOL.submit(_dispatch, *args, *sub) for sub in run]
+            results.extend(f.result() for f in futures)
+        else:
+            results.append(_dispatch(*args, *run[0]))
+    return jsonify(responses=results)
@@ -1,50 +1,42 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app, send_file, send_from_directory, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt, decode_token
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from concurrent.futures import wait
 from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.lib.colors import HexColor
 from datetime import datetime
+from pagination import list_response
+from serializers import report as _pub_report, REPORT_FIELDS
+from versions import conditional, bump, key
+from changes import tombstone
+from certificates import draw_certificate, cached, certificate_key, JOBS, export_filter, archive, EXPORT_FIELDS
+from workers import LocalPool, LocalProcessPool
+from summary import summary_pdf, describe, SUMMARY_FIELDS
+from errors import ApiError
 
 bp = Blueprint("compliance", __name__)
 
-def _pub_report(doc):
-    """Format compliance report document for API response"""
-    return {
-        "id": str(doc["_id"]),
-        "user_id": str(doc["user_id"]),
-        "username": doc.get("username"),
-        "project_name": doc.get("project_name"),
-        "species_choice": doc.get("species_choice"),
-        "area_sqm": doc.get("area_sqm"),
-        "trees_planned": doc.get("trees_planned"),
-        "lat": doc.get("lat"),
-        "lon": doc.get("lon"),
-        "status": doc.get("status","Pending"),
-        "result": doc.get("result",{})
-    }
+# renders certificates of just-approved reports (see certificates.py)
+RENDER_POOL = LocalPool("certificates", "CERT_WORKERS")
+# renders the missing certificates of an export, one process per core
+EXPORT_POOL = LocalProcessPool("CERT_EXPORT_WORKERS")
 
-@bp.route("/compliance-check", methods=["POST"])
-@jwt_required()
-def compliance_check():
+DUPLICATE_MSG = "A pending compliance report for project '{}' already exists. Please delete the existing report or wait for approval before submitting again."
+
+def new_report(data, user_id, username):
     """
-    Submit a compliance check for a green project.
-    Calculates required trees and compliance status.
-    Prevents duplicate pending submissions for the same project.
+    Validate a compliance-check submission and build the report document.
+    Raises ValueError when the project name is missing.
+    Shared with the ASGI app (asgi.py).
     """
-    claims = get_jwt()
-    user_id = claims["sub"]
-    username = claims.get("username","user")
-    data = request.get_json() or {}
-    
     # Extract and validate input data
     project_name = data.get("project_name", "Project").strip()
     
     # Validate project name
     if not project_name:
-        return jsonify(msg="Project name is required"), 400
+        raise ValueError("Project name is required")
     
     area = float(data.get("area_sqm", 0))
     trees = int(data.get("trees_planned", 0))
@@ -54,19 +46,6 @@ def compliance_check():
     lat = float(data.get("lat",0))
     lon = float(data.get("lon",0))
 
-    # ⚠️ PREVENT DUPLICATE SUBMISSIONS ⚠️
-    # Check if a pending report with the same project name already exists for this user
-    existing = current_app.db.reports.find_one({
-        "user_id": ObjectId(user_id),
-        "project_name": project_name,
-        "status": "Pending"
-    })
-    
-    if existing:
-        return jsonify(
-            msg=f"A pending compliance report for project '{project_name}' already exists. Please delete the existing report or wait for approval before submitting again."
-        ), 409  # 409 Conflict status code
-
     # Calculate compliance requirements
     # Rule: 1 tree per 80 sqm
     required_trees = int((area + 79)//80) if area>0 else 0
@@ -75,7 +54,8 @@ def compliance_check():
     compliant = bool(compliant_by_trees or compliant_by_area)
 
     # Create compliance report document
-    doc = {
+    now = datetime.utcnow()
+    return {
         "user_id": ObjectId(user_id),
         "username": username,
         "project_name": project_name,
@@ -91,77 +71,189 @@ def compliance_check():
             "delta_trees": trees - required_trees,
             "compliant": compliant
         },
-        "created_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
-    
-    # Insert into database
-    current_app.db.reports.insert_one(doc)
-    return jsonify(_pub_report(doc)), 201
-
-@bp.route("/compliance-reports", methods=["GET"])
-@jwt_required()
-def my_reports():
-    """Get all compliance reports for the authenticated user"""
-    claims = get_jwt()
-    uid = ObjectId(claims["sub"])
-    docs = current_app.db.reports.find({"user_id": uid}).sort("created_at",-1)
-    return jsonify(reports=[_pub_report(d) for d in docs])
 
-@bp.route("/compliance-report/<rid>", methods=["DELETE"])
-@jwt_required()
-def delete_compliance_report(rid):
+def submit_report(db, data, user_id, username):
     """
-    Delete a compliance report (only if Pending status and owner).
-    This prevents deletion of approved reports.
+    Store a compliance-check submission; the report document, or ApiError.
+    Shared with the ASGI app (asgi.py), like the functions below.
     """
-    claims = get_jwt()
-    uid = ObjectId(claims["sub"])
+    try:
+        doc = new_report(data, user_id, username)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+
+    # ⚠️ PREVENT DUPLICATE SUBMISSIONS ⚠️
+    # Check if a pending report with the same project name already exists for this user
+    existing = db.reports.find_one({
+        "user_id": doc["user_id"],
+        "project_name": doc["project_name"],
+        "status": "Pending"
+    }, {"_id": 1})
+    
+    if existing:
+        raise ApiError(409, DUPLICATE_MSG.format(doc["project_name"]))  # 409 Conflict status code
+    
+    # Insert into database
+    db.reports.insert_one(doc)
+    bump(db, key("reports", user_id), key("reports", "pending"))
+    return doc
+
+def delete_report(db, uid, rid):
+    """Delete one of `uid`'s reports if still Pending"""
+    # Validate ObjectId format
+    try:
+        report_id = ObjectId(rid)
+    except InvalidId:
+        raise ApiError(400, "Invalid report ID format", "error")
     
     try:
-        # Validate ObjectId format
-        try:
-            report_id = ObjectId(rid)
-        except:
-            return jsonify(error="Invalid report ID format"), 400
-        
         # Find the report and verify ownership
-        report = current_app.db.reports.find_one({
-            "_id": report_id,
-            "user_id": uid
-        })
+        report = db.reports.find_one({"_id": report_id, "user_id": uid}, {"user_id": 1, "status": 1})
         
         if not report:
-            return jsonify(error="Report not found or unauthorized"), 404
+            raise ApiError(404, "Report not found or unauthorized", "error")
         
         # Only allow deletion of pending reports
         if report.get("status") != "Pending":
-            return jsonify(error="Can only delete pending reports"), 403
+            raise ApiError(403, "Can only delete pending reports", "error")
         
         # Delete from database
-        result = current_app.db.reports.delete_one({
+        result = db.reports.delete_one({
             "_id": report_id,
             "user_id": uid,
             "status": "Pending"
         })
-        
-        if result.deleted_count > 0:
-            return jsonify(success=True, message="Report deleted successfully"), 200
-        else:
-            return jsonify(error="Failed to delete report"), 500
+    except PyMongoError as e:
+        raise ApiError(500, str(e), "error")
+
+    if result.deleted_count == 0:
+        raise ApiError(500, "Failed to delete report", "error")
+    db.tombstones.insert_one(tombstone("reports", report))
+    bump(db, key("reports", uid), key("reports", "pending"))
+    return {"success": True, "message": "Report deleted successfully"}
+
+def approve_report(db, rid):
+    """
+    Approve a report; the approved document, or None if it already was
+    (it keeps its approval date, the issue date on the certificate).
+    """
+    try:
+        report_id = ObjectId(rid)
+    except InvalidId:
+        raise ApiError(400, "Invalid report ID")
     
-    except Exception as e:
-        current_app.logger.error(f"Error deleting report {rid}: {str(e)}")
-        return jsonify(error=str(e)), 500
+    now = datetime.utcnow()
+    # one conditional write: concurrent approvals find the report approved
+    d = db.reports.find_one_and_update(
+        {"_id": report_id, "status": {"$ne": "Approved"}},
+        {"$set": {"status": "Approved", "approved_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not d:
+        if db.reports.find_one({"_id": report_id}, {"_id": 1}):
+            return None
+        raise ApiError(404, "not found")
+    bump(db, key("reports", d["user_id"]), key("reports", "pending"))
+    return d
+
+def role_of(claims):
+    return claims.get("claims",{}).get("role") or claims.get("role")
+
+def certificate_report(db, rid, claims):
+    """The report whose certificate `claims` may download (owner or government), or ApiError"""
+    try:
+        report_id = ObjectId(rid)
+    except InvalidId:
+        raise ApiError(400, "Invalid report ID")
+    
+    report = db.reports.find_one({"_id": report_id})
+    if not report: 
+        raise ApiError(404, "not found")
+
+    # Check authorization
+    if role_of(claims) != "government" and str(report["user_id"]) != claims.get("sub"):
+        raise ApiError(403, "forbidden")
+    return report
+
+def report_filter(claims, args, status=None):
+    """
+    (export_filter() arguments, query, sort field) of an export / summary
+    request: government only, `args` its query string (status, from, to,
+    user), `status` the default status.
+    """
+    if role_of(claims) != "government":
+        raise ApiError(403, "forbidden")
+    filters = [args.get("status") or status] + [args.get(name) or None for name in ("from", "to", "user")]
+    try:
+        query, field = export_filter(*filters)
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    return filters, query, field
+
+def _reports(db, query, field, fields, batch_size):
+    return db.reports.find(query, fields).sort([(field, 1), ("_id", 1)]).batch_size(batch_size)
+
+def export_chunks(db, query, field, batch_size, cert_dir, secret, submit, window):
+    """certificates.archive() of the reports matching `query`, oldest first"""
+    cursor = _reports(db, query, field, EXPORT_FIELDS, batch_size)
+    try:
+        yield from archive(cursor, cert_dir, secret, submit, window)
+    finally:
+        cursor.close()
+
+def summary_chunks(db, query, field, batch_size, filters):
+    """summary_pdf() of the reports matching `query`, oldest first"""
+    cursor = _reports(db, query, field, SUMMARY_FIELDS, batch_size)
+    try:
+        yield from summary_pdf(cursor, describe(*filters))
+    finally:
+        cursor.close()
+
+@bp.route("/compliance-check", methods=["POST"])
+@jwt_required()
+def compliance_check():
+    """
+    Submit a compliance check for a green project.
+    Calculates required trees and compliance status.
+    Prevents duplicate pending submissions for the same project.
+    """
+    claims = get_jwt()
+    data = request.get_json() or {}
+    doc = submit_report(current_app.db, data, claims["sub"], claims.get("username","user"))
+    return jsonify(_pub_report(doc)), 201
+
+@bp.route("/compliance-reports", methods=["GET"])
+@jwt_required()
+def my_reports():
+    """Get compliance reports for the authenticated user (newest first, ?limit=&cursor= to page)"""
+    claims = get_jwt()
+    uid = ObjectId(claims["sub"])
+    return conditional([key("reports", uid)], lambda: list_response(
+        current_app.db.reports, {"user_id": uid}, "reports", _pub_report, -1, fields=REPORT_FIELDS))
+
+@bp.route("/compliance-report/<rid>", methods=["DELETE"])
+@jwt_required()
+def delete_compliance_report(rid):
+    """
+    Delete a compliance report (only if Pending status and owner).
+    This prevents deletion of approved reports.
+    """
+    claims = get_jwt()
+    return jsonify(delete_report(current_app.db, ObjectId(claims["sub"]), rid))
 
 @bp.route("/admin/compliance-pending", methods=["GET"])
 @jwt_required()
 def admin_pending():
-    """Get all pending compliance reports (government only)"""
+    """Get pending compliance reports, oldest first (government only, ?limit=&cursor= to page)"""
     claims = get_jwt()
     if claims.get("role")!="government":
         return jsonify(msg="forbidden"), 403
-    docs = current_app.db.reports.find({"status":"Pending"}).sort("created_at",1)
-    return jsonify(reports=[_pub_report(d) for d in docs])
+    return conditional([key("reports", "pending")], lambda: list_response(
+        current_app.db.reports, {"status":"Pending"}, "reports", _pub_report, 1,
+        streamable=True, fields=REPORT_FIELDS))
 
 @bp.route("/compliance-approve/<rid>", methods=["PUT"])
 @jwt_required()
@@ -170,108 +262,16 @@ def approve(rid):
     claims = get_jwt()
     if claims.get("role")!="government":
         return jsonify(msg="forbidden"), 403
-    
-    try:
-        report_id = ObjectId(rid)
-    except:
-        return jsonify(msg="Invalid report ID"), 400
-    
-    d = current_app.db.reports.find_one({"_id": report_id})
-    if not d: 
-        return jsonify(msg="not found"), 404
-    
-    current_app.db.reports.update_one(
-        {"_id": d["_id"]}, 
-        {"$set": {"status":"Approved","approved_at": datetime.utcnow()}}
-    )
+    d = approve_report(current_app.db, rid)
+    if d:
+        render_later(d)
     return jsonify(ok=True)
 
-def _draw_certificate(buffer, report):
-    """Generate PDF certificate for approved compliance report"""
-    c = canvas.Canvas(buffer, pagesize=A4)
-    W,H = A4
-    brand = HexColor("#2d6a4f")
-    brand2 = HexColor("#40916c")
-    line = HexColor("#d8f3dc")
-
-    # Draw border
-    c.setStrokeColor(line)
-    c.setLineWidth(3)
-    c.rect(12*mm, 12*mm, W-24*mm, H-24*mm)
-
-    # Title
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(30*mm, H-40*mm, "Verdantia Green Compliance Certificate")
-    c.setFillColor(brand2)
-    c.setFont("Helvetica", 12)
-    c.drawString(30*mm, H-47*mm, "AI-powered Afforestation Planner")
-
-    # Project details
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(30*mm, H-65*mm, "Project:")
-    c.setFillColor(HexColor("#1b4332"))
-    c.setFont("Helvetica", 12)
-    c.drawString(60*mm, H-65*mm, report.get("project_name",""))
-
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(30*mm, H-75*mm, "Applicant:")
-    c.setFillColor(HexColor("#1b4332"))
-    c.setFont("Helvetica", 12)
-    c.drawString(60*mm, H-75*mm, report.get("username",""))
-
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(30*mm, H-85*mm, "Selected Species:")
-    c.setFillColor(HexColor("#1b4332"))
-    c.setFont("Helvetica", 12)
-    c.drawString(80*mm, H-85*mm, report.get("species_choice",""))
-
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(30*mm, H-95*mm, "Location:")
-    c.setFillColor(HexColor("#1b4332"))
-    c.setFont("Helvetica", 12)
-    loc = f"Lat {report.get('lat')}, Lon {report.get('lon')}"
-    c.drawString(60*mm, H-95*mm, loc)
-
-    # Planting guidance
-    c.setFillColor(brand)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(30*mm, H-110*mm, "Planting Location Guidance")
-    c.setFillColor(HexColor("#1b4332"))
-    c.setFont("Helvetica", 11)
-    guidance = [
-        "Plant approved species within the project boundary at provided coordinates.",
-        "Prioritize perimeters, open courtyards, and contour lines.",
-        "Maintain mixed clusters with ~1600 saplings/ha for rapid canopy and resilience.",
-        "Use mulching & rainwater harvesting to sustain growth during dry months."
-    ]
-    y = H-120*mm
-    for line_txt in guidance:
-        c.drawString(30*mm, y, line_txt)
-        y -= 7*mm
-
-    # Footer
-    c.setStrokeColor(line)
-    c.line(30*mm, 30*mm, W-30*mm, 30*mm)
-    c.setFillColor(brand2)
-    c.setFont("Helvetica", 10)
-    footer_text = "Issued by: Government Authority via Verdantia · "+ datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
-    c.drawString(30*mm, 25*mm, footer_text)
-    
-    c.showPage()
-    c.save()
-
-@bp.route("/compliance-certificate/<rid>", methods=["GET"])
-def certificate(rid):
+def download_claims():
     """
-    Download compliance certificate PDF.
-    Accessible by report owner and government users.
+    (claims, None) from the Authorization header or ?token= (plain links can
+    download files), else (None, error response)
     """
-    # Extract token from Authorization header or query param
     token = None
     auth = request.headers.get("Authorization","")
     if auth.startswith("Bearer "):
@@ -279,40 +279,95 @@ def certificate(rid):
     if not token:
         token = request.args.get("token")
     if not token:
-        return jsonify(msg="Missing Authorization Header"), 401
+        return None, (jsonify(msg="Missing Authorization Header"), 401)
     
     # Decode and validate token
     try:
-        claims = decode_token(token)
+        return decode_token(token), None
     except Exception as e:
         current_app.logger.error(f"Token decode error: {str(e)}")
-        return jsonify(msg="invalid token"), 401
+        return None, (jsonify(msg="invalid token"), 401)
 
-    # Find the report
-    try:
-        report_id = ObjectId(rid)
-    except:
-        return jsonify(msg="Invalid report ID"), 400
-    
-    report = current_app.db.reports.find_one({"_id": report_id})
-    if not report: 
-        return jsonify(msg="not found"), 404
+def render_later(report):
+    """Render an approved report's certificate on RENDER_POOL, ahead of its first download"""
+    cert_dir, secret = current_app.config["CERT_DIR"], current_app.config["JWT_SECRET_KEY"]
+    JOBS.start(certificate_key(report, secret), lambda: RENDER_POOL.submit(cached, report, cert_dir, secret))
 
-    # Check authorization
-    uid = claims.get("sub")
-    role = claims.get("claims",{}).get("role") or claims.get("role")
-    if role != "government" and str(report["user_id"]) != uid:
-        return jsonify(msg="forbidden"), 403
+@bp.route("/compliance-certificate/<rid>", methods=["GET"])
+def certificate(rid):
+    """
+    Download compliance certificate PDF.
+    Accessible by report owner and government users.
+    """
+    claims, error = download_claims()
+    if error:
+        return error
+    report = certificate_report(current_app.db, rid, claims)
 
-    # Generate PDF certificate
+    filename = f"certificate_{rid}.pdf"
+    if report.get("status") == "Approved":
+        cert_dir, secret = current_app.config["CERT_DIR"], current_app.config["JWT_SECRET_KEY"]
+        # still rendering in the background: wait a little, then tell the client to come back
+        job = JOBS.get(certificate_key(report, secret))
+        if job is not None and not wait([job], timeout=current_app.config["CERT_RENDER_WAIT"]).done:
+            return jsonify(msg="certificate is being generated, please retry"), 202, {"Retry-After": "1"}
+        # rendered once (inline if no background render ran in this process),
+        # then sent from disk (sendfile) with a strong ETag
+        name, etag = cached(report, cert_dir, secret)
+        return send_from_directory(
+            cert_dir,
+            name,
+            download_name=filename,
+            as_attachment=True,
+            mimetype="application/pdf",
+            etag=etag
+        )
+
+    # Not approved yet: render on the fly
     buf = BytesIO()
-    _draw_certificate(buf, report)
+    draw_certificate(buf, report)
     buf.seek(0)
-    filename = f"certificate_{rid}.pdf"
     
     return send_file(
         buf, 
         download_name=filename, 
         as_attachment=True, 
         mimetype="application/pdf"
-    )
\ No newline at end of file
+    )
+
+@bp.route("/admin/certificates-export", methods=["GET"])
+def export_certificates():
+    """
+    ZIP of the certificates of many reports (government only), streamed as it
+    is built: ?status=Approved|Pending&from=&to=&user=<username or id>, with
+    from / to ISO dates bounding the approval (or creation) time, to exclusive.
+    """
+    claims, error = download_claims()
+    if error:
+        return error
+    _, query, field = report_filter(claims, request.args, "Approved")
+    chunks = export_chunks(current_app.db, query, field, current_app.config["STREAM_BATCH_SIZE"],
+                           current_app.config["CERT_DIR"], current_app.config["JWT_SECRET_KEY"],
+                           EXPORT_POOL.submit, 2 * EXPORT_POOL.size)
+
+    resp = Response(stream_with_context(chunks), mimetype="application/zip")
+    resp.headers["Content-Disposition"] = "attachment; filename=certificates.zip"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+@bp.route("/admin/compliance-summary", methods=["GET"])
+def compliance_summary():
+    """
+    Multi-page PDF table of reports (government only), streamed page by page:
+    ?status=Approved|Pending (default all)&from=&to=&user=, as for the export.
+    """
+    claims, error = download_claims()
+    if error:
+        return error
+    filters, query, field = report_filter(claims, request.args)
+    chunks = summary_chunks(current_app.db, query, field, current_app.config["STREAM_BATCH_SIZE"], filters)
+
+    resp = Response(stream_with_context(chunks), mimetype="application/pdf")
+    resp.headers["Content-Disposition"] = "attachment; filename=compliance_summary.pdf"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
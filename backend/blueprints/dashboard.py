@@ -0,0 +1,74 @@
+"""
+Everything the dashboard's refreshAll() needs in one response: the user,
+their reports and uploads (or, for government users, both pending queues)
+and the leaderboard. The queries run concurrently on a small thread pool,
+so the response takes as long as the slowest query rather than the sum.
+The ETag covers the version counters of every part (see versions.py), so
+an unchanged dashboard is answered with 304 before any of them run.
+"""
+from bson import ObjectId
+from flask import Blueprint, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt
+from pagination import sort_spec
+from serializers import (report as _pub_report, upload as _pub_upload, user as _pub_user, upload_base,
+                         REPORT_FIELDS, UPLOAD_FIELDS, USER_FIELDS)
+from workers import LocalPool
+from versions import conditional, key
+from blueprints.gamification import leaderboard_top, leaderboard_snapshot
+from errors import ApiError
+
+bp = Blueprint("dashboard", __name__)
+
+POOL = LocalPool("dashboard", "DASHBOARD_WORKERS")
+
+
+def _listing(collection, query, fields, serialize, direction):
+    # same order as the paginated list endpoints
+    return [serialize(d) for d in collection.find(query, fields).sort(sort_spec(direction))]
+
+
+@bp.route("/dashboard", methods=["GET"])
+@jwt_required()
+def dashboard():
+    claims = get_jwt()
+    uid = ObjectId(claims["sub"])
+    owner = "pending" if claims.get("role") == "government" else uid
+    keys = [key("users", uid), key("reports", owner), key("uploads", owner)]
+    _, board = leaderboard_snapshot(current_app.db)
+    return conditional(keys, lambda: _dashboard(claims, uid), "board=" + board)
+
+
+def dashboard_queries(db, claims, uid, base):
+    """
+    {part: function running its query} for the user / government dashboard,
+    `base` the upload URL prefix. Shared with asgi.py, which runs them the
+    same way on its own threads.
+    """
+    pub_upload = lambda d: _pub_upload(d, base)
+    out = {
+        "user": lambda: db.users.find_one({"_id": uid}, USER_FIELDS),
+        "leaderboard": lambda: leaderboard_top(db),
+    }
+    if claims.get("role") == "government":
+        out["pending_reports"] = lambda: _listing(db.reports, {"status": "Pending"}, REPORT_FIELDS, _pub_report, 1)
+        out["pending_uploads"] = lambda: _listing(db.uploads, {"status": "Pending"}, UPLOAD_FIELDS, pub_upload, 1)
+    else:
+        out["reports"] = lambda: _listing(db.reports, {"user_id": uid}, REPORT_FIELDS, _pub_report, -1)
+        out["videos"] = lambda: _listing(db.uploads, {"user_id": uid}, UPLOAD_FIELDS, pub_upload, -1)
+    return out
+
+
+def dashboard_payload(out):
+    """Response body from the results of dashboard_queries()"""
+    if not out["user"]:
+        raise ApiError(404, "not found")
+    out["user"] = _pub_user(out["user"])
+    return out
+
+
+def _dashboard(claims, uid):
+    parts = dashboard_queries(current_app.db, claims, uid, upload_base())
+    # tasks run in a copy of the request context, so DB timings are still
+    # attributed to this route
+    futures = {name: POOL.submit(fn) for name, fn in parts.items()}
+    return jsonify(dashboard_payload({name: f.result() for name, f in futures.items()}))
@@ -2,9 +2,21 @@ import os
 import secrets
 from datetime import datetime
 from bson import ObjectId
-from flask import Blueprint, request, jsonify, current_app, url_for
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 from werkzeug.utils import secure_filename
+from pagination import list_response, page_args
+from serializers import upload as _pub_upload, voucher as _pub_voucher, UPLOAD_FIELDS, VOUCHER_FIELDS
+from leaderboard import (LEADERBOARD, RANKED, ORDER, REVERSE, FIELDS, ahead, behind, ranked,
+                         encode_position, decode_position, PERIODS, bucket_start, bucket_end,
+                         window_updates, window_query, WINDOW_ORDER)
+from ledger import record, hold, apply_held, settle, approve_key, revoke_key, redeem_key
+from versions import conditional, conditional_response, bump, key
+from changes import tombstone
+from errors import ApiError
 
 bp = Blueprint("gamification", __name__)
 
@@ -21,35 +33,135 @@ VOUCHER_CATALOG = {
     "V200": {"brand": "Planet Play",   "value": 200, "desc": "Rs. 200 off — games"},
 }
 
-def _pub_upload(d):
-    url = None
-    if d.get("filename"):
-        url = url_for("serve_upload", filename=d["filename"], _external=True)
-    return {
-        "id": str(d["_id"]),
-        "user_id": str(d["user_id"]),
-        "filename": d.get("filename"),
-        "status": d.get("status","Pending"),
-        "points_awarded": int(d.get("points_awarded",0)),
-        "url": url
-    }
+# what LEADERBOARD.update() needs from the user after a points change
+SCORE_FIELDS = {"username": 1, "points": 1, "role": 1}
 
-def _pub_voucher(r):
-    return {
-        "id": str(r["_id"]),
-        "user_id": str(r["user_id"]),
-        "voucher_id": r["voucher_id"],
-        "brand": r["brand"],
-        "value": int(r["value"]),
-        "code": r.get("code"),
-        "created_at": r["created_at"].isoformat() + "Z",
-        "status": r.get("status","Issued")
-    }
+def record_earned(db, user, amount, when, ref):
+    """
+    Add (or, negative, take back) points earned at `when` to the weekly /
+    monthly boards, once per ledger entry `ref`
+    """
+    if not user:
+        return
+    try:
+        db.points_windows.bulk_write(window_updates(user, amount, when, ref), ordered=False)
+    except BulkWriteError as e:
+        # duplicate keys: rows that already count `ref`
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
 
 # --------------------------
 # Uploads / Proof-of-planting
 # --------------------------
 
+def upload_filename(uid, original):
+    """Stored filename for an upload, or None if the extension is not allowed (shared with asgi.py)"""
+    ext = original.rsplit(".",1)[-1].lower() if "." in original else ""
+    if ext not in ALLOWED:
+        return None
+    return secure_filename(f"{uid}_{int(datetime.utcnow().timestamp())}_{original}")
+
+def new_upload(uid, filename):
+    now = datetime.utcnow()
+    return {
+        "user_id": ObjectId(uid),
+        "filename": filename,
+        "status": "Pending",
+        "points_awarded": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def add_upload(db, uid, filename):
+    """Record a saved upload for review; the document (shared with asgi.py, like the functions below)"""
+    doc = new_upload(uid, filename)
+    db.uploads.insert_one(doc)
+    bump(db, key("uploads", uid), key("uploads", "pending"))
+    return doc
+
+def delete_upload(db, uid, uidoc, upload_dir):
+    """Delete one of `uid`'s uploads, taking back the points it earned"""
+    try:
+        upload_id = ObjectId(uidoc)
+        # Find the upload - ensure it belongs to the current user - and mark
+        # it, so that an approval from now on leaves it alone (approve_upload)
+        upload = db.uploads.find_one_and_update({"_id": upload_id, "user_id": uid}, {"$set": {"deleting": True}})
+        
+        if not upload:
+            raise ApiError(404, "Upload not found or unauthorized", "error")
+        
+        # If approved, deduct the points that were awarded (once, even if deleted concurrently)
+        changed = [key("uploads", uid), key("uploads", "pending")]
+        awarded = upload.get("points_awarded", 0)
+        if upload.get("status") == "Approved" and awarded > 0:
+            record(db, revoke_key(upload_id), uid, -awarded, "upload_deleted", upload_id)
+            # out of the buckets it was earned in, after finishing the approval's
+            # own window update in case it stopped short; each counts once
+            u = db.users.find_one({"_id": uid}, SCORE_FIELDS)
+            when = upload.get("approved_at") or upload["created_at"]
+            record_earned(db, u, awarded, when, approve_key(upload_id))
+            record_earned(db, u, -awarded, when, revoke_key(upload_id))
+            changed.append(key("users"))
+        else:
+            # an approval that lost the race to the mark may have recorded its award
+            prior = db.points_ledger.find_one({"_id": approve_key(upload_id)}, {"amount": 1})
+            if prior:
+                record(db, revoke_key(upload_id), uid, -prior["amount"], "upload_deleted", upload_id)
+        
+        # Delete the file from filesystem if it exists
+        if upload.get("filename"):
+            file_path = os.path.join(upload_dir, upload["filename"])
+            if os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except OSError as e:
+                    print(f"Warning: Could not delete file {file_path}: {e}")
+        
+        # Delete from database
+        result = db.uploads.delete_one({"_id": upload_id, "user_id": uid})
+    except (InvalidId, PyMongoError) as e:
+        raise ApiError(500, str(e), "error")
+
+    if result.deleted_count == 0:
+        raise ApiError(500, "Failed to delete upload", "error")
+    db.tombstones.insert_one(tombstone("uploads", upload))
+    bump(db, *changed)
+    return {"success": True, "message": "Upload deleted successfully"}
+
+def approve_upload(db, uidoc):
+    """Approve an upload and award its points, once however often it is approved"""
+    try:
+        upload_id = ObjectId(uidoc)
+    except InvalidId:
+        raise ApiError(400, "Invalid upload ID")
+    fields = {"user_id": 1, "status": 1, "approved_at": 1, "created_at": 1}
+    d = db.uploads.find_one({"_id": upload_id}, fields)
+    if not d:
+        raise ApiError(404, "not found")
+    # the ledger key makes the award happen once; an approval that finds it
+    # already recorded (a concurrent one, or a retry after a crash) still
+    # finishes the approval below
+    owner = d["user_id"]
+    record(db, approve_key(upload_id), owner, 50, "upload_approved", upload_id)
+    if d.get("status") != "Approved":
+        now = datetime.utcnow()
+        # not once delete_upload has marked it
+        d = db.uploads.find_one_and_update(
+            {"_id": upload_id, "status": {"$ne": "Approved"}, "deleting": {"$ne": True}},
+            {"$set": {"status":"Approved","points_awarded": 50, "approved_at": now, "updated_at": now}},
+            projection=fields,
+            return_document=ReturnDocument.AFTER,
+        ) or db.uploads.find_one({"_id": upload_id, "status": "Approved"}, fields)
+        if not d:
+            # deleted first: the deletion found no award to take back
+            record(db, revoke_key(upload_id), owner, -50, "upload_deleted", upload_id)
+            raise ApiError(404, "not found")
+    # the windows count the award once too, however many approvals get here
+    u = db.users.find_one({"_id": owner}, SCORE_FIELDS)
+    record_earned(db, u, 50, d.get("approved_at") or d["created_at"], approve_key(upload_id))
+    # users:all for the weekly / monthly boards; the balance follows at compaction
+    bump(db, key("uploads", owner), key("uploads", "pending"), key("users"))
+
 @bp.route("/upload-video", methods=["POST"])
 @jwt_required()
 def upload_video():
@@ -58,76 +170,27 @@ def upload_video():
     f = request.files.get("file")
     if not f:
         return jsonify(msg="file required"), 400
-    ext = f.filename.rsplit(".",1)[-1].lower() if "." in f.filename else ""
-    if ext not in ALLOWED:
+    safe = upload_filename(uid, f.filename)
+    if not safe:
         return jsonify(msg="invalid file type"), 400
-    safe = secure_filename(f"{uid}_{int(datetime.utcnow().timestamp())}_{f.filename}")
     path = os.path.join(current_app.config["UPLOAD_DIR"], safe)
     f.save(path)
-    doc = {
-        "user_id": ObjectId(uid),
-        "filename": safe,
-        "status": "Pending",
-        "points_awarded": 0,
-        "created_at": datetime.utcnow()
-    }
-    current_app.db.uploads.insert_one(doc)
-    return jsonify(_pub_upload(doc))
+    return jsonify(_pub_upload(add_upload(current_app.db, uid, safe)))
 
 @bp.route("/my-videos", methods=["GET"])
 @jwt_required()
 def my_videos():
     claims = get_jwt()
     uid = ObjectId(claims["sub"])
-    docs = current_app.db.uploads.find({"user_id": uid}).sort("created_at",-1)
-    return jsonify(videos=[_pub_upload(d) for d in docs])
+    return conditional([key("uploads", uid)], lambda: list_response(
+        current_app.db.uploads, {"user_id": uid}, "videos", _pub_upload, -1, fields=UPLOAD_FIELDS))
 
 @bp.route("/upload-video/<uidoc>", methods=["DELETE"])
 @jwt_required()
 def delete_upload_video(uidoc):
     """Delete an uploaded video/image (only by owner)"""
     claims = get_jwt()
-    uid = ObjectId(claims["sub"])
-    
-    try:
-        # Find the upload - ensure it belongs to the current user
-        upload = current_app.db.uploads.find_one({
-            "_id": ObjectId(uidoc),
-            "user_id": uid
-        })
-        
-        if not upload:
-            return jsonify(error="Upload not found or unauthorized"), 404
-        
-        # If approved, deduct the points that were awarded
-        if upload.get("status") == "Approved" and upload.get("points_awarded", 0) > 0:
-            current_app.db.users.update_one(
-                {"_id": uid},
-                {"$inc": {"points": -upload["points_awarded"]}}
-            )
-        
-        # Delete the file from filesystem if it exists
-        if upload.get("filename"):
-            file_path = os.path.join(current_app.config["UPLOAD_DIR"], upload["filename"])
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except Exception as e:
-                    print(f"Warning: Could not delete file {file_path}: {e}")
-        
-        # Delete from database
-        result = current_app.db.uploads.delete_one({
-            "_id": ObjectId(uidoc),
-            "user_id": uid
-        })
-        
-        if result.deleted_count > 0:
-            return jsonify(success=True, message="Upload deleted successfully"), 200
-        else:
-            return jsonify(error="Failed to delete upload"), 500
-    
-    except Exception as e:
-        return jsonify(error=str(e)), 500
+    return jsonify(delete_upload(current_app.db, ObjectId(claims["sub"]), uidoc, current_app.config["UPLOAD_DIR"]))
 
 @bp.route("/admin/uploads-pending", methods=["GET"])
 @jwt_required()
@@ -135,8 +198,9 @@ def admin_uploads_pending():
     claims = get_jwt()
     if claims.get("role")!="government":
         return jsonify(msg="forbidden"), 403
-    docs = current_app.db.uploads.find({"status":"Pending"}).sort("created_at",1)
-    return jsonify(uploads=[_pub_upload(d) for d in docs])
+    return conditional([key("uploads", "pending")], lambda: list_response(
+        current_app.db.uploads, {"status":"Pending"}, "uploads", _pub_upload, 1,
+        streamable=True, fields=UPLOAD_FIELDS))
 
 @bp.route("/upload-approve/<uidoc>", methods=["PUT"])
 @jwt_required()
@@ -144,66 +208,158 @@ def upload_approve(uidoc):
     claims = get_jwt()
     if claims.get("role")!="government":
         return jsonify(msg="forbidden"), 403
-    d = current_app.db.uploads.find_one({"_id": ObjectId(uidoc)})
-    if not d:
-        return jsonify(msg="not found"), 404
-    if d.get("status") == "Approved":
-        return jsonify(ok=True)
-    current_app.db.uploads.update_one(
-        {"_id": d["_id"]},
-        {"$set": {"status":"Approved","points_awarded": 50, "approved_at": datetime.utcnow()}}
-    )
-    current_app.db.users.update_one({"_id": d["user_id"]}, {"$inc": {"points": 50}})
+    approve_upload(current_app.db, uidoc)
     return jsonify(ok=True)
 
 # --------------------------
 # Leaderboard
 # --------------------------
 
+def top_users(db, n=20):
+    """Highest-scoring non-government users, best first (ties: newest account first)"""
+    return list(db.users.find(RANKED, FIELDS).sort(ORDER).limit(n))
+
+def leaderboard_top(db):
+    """Top users from the in-memory board, reloading it when stale"""
+    return leaderboard_snapshot(db)[0]
+
+def leaderboard_snapshot(db):
+    """(top users, tag) from the in-memory board, reloading it when stale"""
+    if not LEADERBOARD.fresh:
+        LEADERBOARD.load(top_users(db, LEADERBOARD.capacity))
+    return LEADERBOARD.snapshot()
+
+def leaderboard_page(db, limit, start):
+    """One page of the whole board, from pagination.page_args(decode=decode_position)"""
+    query, position, rank, points = RANKED, 0, 0, None
+    if start:
+        points, oid, position, rank = start
+        query = {**RANKED, **behind(points, oid)}
+    users = list(db.users.find(query, FIELDS).sort(ORDER).limit(limit + 1))
+    rows = ranked(users[:limit], position, rank, points)
+    next_cursor = None
+    if len(users) > limit:
+        next_cursor = encode_position(users[limit - 1], position + limit, rows[-1]["rank"])
+    return {"leaderboard": rows, "next_cursor": next_cursor}
+
+def window_start(period, ago, now):
+    """Start of the `period` bucket `ago` (query string value) buckets back"""
+    if period not in PERIODS:
+        raise ApiError(400, "period must be one of: all, " + ", ".join(PERIODS))
+    try:
+        ago = max(0, int(ago or 0))
+    except ValueError:
+        raise ApiError(400, "ago must be an integer")
+    return bucket_start(period, now, ago)
+
+def window_board(db, period, start):
+    """Top users by points earned in the `period` bucket starting at `start`"""
+    rows = db.points_windows.find(
+        window_query(period, start), {"_id": 0, "username": 1, "points": 1}
+    ).sort(WINDOW_ORDER).limit(LEADERBOARD.size)
+    return {"leaderboard": ranked(rows), "period": period, "start": start, "end": bucket_end(period, start)}
+
+def rank_window(db, uid, around):
+    """
+    The user's rank and up to `around` (query string value, default 2, max
+    10) users on each side of them, from two indexed counts and two short
+    index walks.
+    """
+    try:
+        around = max(0, min(int(around or 2), 10))
+    except ValueError:
+        raise ApiError(400, "around must be an integer")
+    me = db.users.find_one({"_id": ObjectId(uid)}, {**FIELDS, "role": 1})
+    if not me:
+        raise ApiError(404, "not found")
+    if me.get("role") == "government":
+        raise ApiError(404, "government accounts are not ranked")
+
+    points = int(me.get("points", 0))
+    position = db.users.count_documents({**RANKED, **ahead(points, me["_id"])}) + 1
+    above = list(db.users.find({**RANKED, **ahead(points, me["_id"])}, FIELDS).sort(REVERSE).limit(around))[::-1]
+    below = list(db.users.find({**RANKED, **behind(points, me["_id"])}, FIELDS).sort(ORDER).limit(around))
+    window = above + [me] + below
+    # rank of the first row: ties may continue above the window
+    first = int(window[0].get("points", 0))
+    first_rank = db.users.count_documents({**RANKED, "points": {"$gt": first}}) + 1
+    rows = ranked(window, position - len(above) - 1, first_rank, first)
+    return {"me": rows[len(above)], "around": rows}
+
 @bp.route("/leaderboard", methods=["GET"])
 def leaderboard():
-    users = current_app.db.users.find(
-        {"role": {"$ne": "government"}},
-        {"username":1,"points":1}
-    ).sort("points",-1).limit(20)
-    return jsonify(leaderboard=[{"username":u.get("username"), "points": int(u.get("points",0))} for u in users])
+    """
+    Top 20 (cached) by default; with `limit` / `cursor` the whole board,
+    page by page, keyset on (points, _id). `period=week|month` (with
+    `ago=N` for earlier buckets) gives the top 20 by points earned then.
+    """
+    period = request.args.get("period", "all")
+    if period != "all":
+        now = datetime.utcnow()
+        start = window_start(period, request.args.get("ago"), now)
+        # the board also changes when a new bucket begins
+        return conditional([key("users")], lambda: jsonify(window_board(current_app.db, period, start)),
+                           start.isoformat(), bucket_start(period, now))
+    try:
+        page = page_args(decode=decode_position)
+    except ValueError as e:
+        return jsonify(msg=str(e)), 400
+    if page is None:
+        # validated against the in-memory board itself: no Mongo round trip at all
+        rows, tag = leaderboard_snapshot(current_app.db)
+        return conditional_response("board=" + tag, None, lambda: jsonify(leaderboard=rows))
+    return conditional([key("users")], lambda: jsonify(leaderboard_page(current_app.db, *page)))
+
+@bp.route("/leaderboard/me", methods=["GET"])
+@jwt_required()
+def leaderboard_me():
+    """The caller's rank and the users around them (`around`, see rank_window())"""
+    return jsonify(rank_window(current_app.db, get_jwt()["sub"], request.args.get("around")))
 
 # --------------------------
 # Voucher Redemption
 # --------------------------
 
-@bp.route("/redeem-voucher", methods=["POST"])
-@jwt_required()
-def redeem_voucher():
+def redeem(db, uid, voucher_id, idempotency_key=None):
     """
-    Request JSON: { "voucher_id": "V100" }
+    Redeem a catalog voucher for `uid`'s points:
     - Validates voucher id and cost (server-truth)
     - Atomically deducts points if sufficient
     - Records redemption, returns a voucher code
+    A repeated `idempotency_key` returns the first redemption.
     """
-    claims = get_jwt()
-    uid = claims["sub"]
-    data = request.get_json(silent=True) or {}
-    voucher_id = (data.get("voucher_id") or "").strip()
-
+    voucher_id = (voucher_id or "").strip()
     if voucher_id not in VOUCHER_CATALOG:
-        return jsonify(error="invalid voucher_id"), 400
+        raise ApiError(400, "invalid voucher_id", "error")
 
     catalog = VOUCHER_CATALOG[voucher_id]
     cost = int(catalog["value"])
 
-    # Atomic deduction to avoid race conditions:
-    # Only deduct if points >= cost
-    res = current_app.db.users.update_one(
-        {"_id": ObjectId(uid), "points": {"$gte": cost}},
-        {"$inc": {"points": -cost}}
-    )
-    if res.modified_count == 0:
-        return jsonify(error="insufficient points"), 400
-
     # Create a simple voucher code
     code = f"{voucher_id}-{secrets.token_hex(3).upper()}"
+    entry_key = redeem_key(uid, idempotency_key or code)
+    if not hold(db, entry_key, ObjectId(uid), -cost, "voucher_redeemed", code):
+        # a retry: finish the first attempt, with its voucher and code
+        prior = db.points_ledger.find_one({"_id": entry_key}, {"ref": 1, "amount": 1})
+        if not prior:
+            raise ApiError(409, "redemption in progress", "error")
+        code, cost = prior["ref"], -prior["amount"]
+        voucher_id = code.rsplit("-", 1)[0]
+        catalog = VOUCHER_CATALOG[voucher_id]
+        r = db.voucher_redemptions.find_one({"user_id": ObjectId(uid), "code": code})
+        if r:
+            return {"ok": True, "code": r["code"], "brand": r["brand"], "value": r["value"]}
+
+    # Atomic deduction to avoid race conditions: awards not yet compacted are
+    # folded in first, then one conditional $inc checks and deducts the balance
+    # and only then is the entry marked applied
+    settle(db, ObjectId(uid), LEADERBOARD.update)
+    if not apply_held(db, entry_key, 0, LEADERBOARD.update):
+        # the entry never took effect; drop it so the key can be retried
+        db.points_ledger.delete_one({"_id": entry_key, "applied": False})
+        raise ApiError(400, "insufficient points", "error")
 
+    now = datetime.utcnow()
     redemption = {
         "user_id": ObjectId(uid),
         "voucher_id": voucher_id,
@@ -211,16 +367,35 @@ def redeem_voucher():
         "value": cost,
         "code": code,
         "status": "Issued",
-        "created_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
     }
-    current_app.db.voucher_redemptions.insert_one(redemption)
+    try:
+        # an upsert, so that a retry after a crash here issues the code once
+        db.voucher_redemptions.update_one({"user_id": ObjectId(uid), "code": code},
+                                          {"$setOnInsert": redemption}, upsert=True)
+    except DuplicateKeyError:
+        pass  # a concurrent retry issued it
+    bump(db, key("vouchers", uid), key("users", uid), key("users"))
+
+    return {"ok": True, "code": code, "brand": catalog["brand"], "value": cost}
 
-    return jsonify(ok=True, code=code, brand=catalog["brand"], value=cost)
+@bp.route("/redeem-voucher", methods=["POST"])
+@jwt_required()
+def redeem_voucher():
+    """
+    Request JSON: { "voucher_id": "V100" }, see redeem().
+    An `Idempotency-Key` header makes retries return the first redemption.
+    """
+    data = request.get_json(silent=True) or {}
+    return jsonify(redeem(current_app.db, get_jwt()["sub"], data.get("voucher_id"),
+                          request.headers.get("Idempotency-Key")))
 
 @bp.route("/my-vouchers", methods=["GET"])
 @jwt_required()
 def my_vouchers():
     claims = get_jwt()
     uid = ObjectId(claims["sub"])
-    cur = current_app.db.voucher_redemptions.find({"user_id": uid}).sort("created_at", -1)
-    return jsonify(vouchers=[_pub_voucher(r) for r in cur])
\ No newline at end of file
+    return conditional([key("vouchers", uid)], lambda: list_response(
+        current_app.db.voucher_redemptions, {"user_id": uid}, "vouchers", _pub_voucher, -1,
+        fields=VOUCHER_FIELDS))
\ No newline at end of file
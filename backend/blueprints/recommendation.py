@@ -23,10 +23,8 @@ CLIMATE_SPECIES = {
     "temperate": ["Quercus spp. (Oak)", "Acer spp. (Maple)", "Pinus roxburghii (Chir Pine)"]
 }
 
-@bp.post("/recommendation")
-@jwt_required()
-def recommendation():
-    data = request.get_json() or {}
+def recommend(data):
+    """Recommendation payload for {lat, lon, area_sqm} (shared with asgi.py)"""
     lat = float(data.get("lat", 0))
     lon = float(data.get("lon", 0))
     area_sqm = float(data.get("area_sqm", 1000))
@@ -49,4 +47,10 @@ def recommendation():
             "species": preferred
         }
     }
-    return jsonify(response)
+    return response
+
+@bp.post("/recommendation")
+@jwt_required()
+def recommendation():
+    data = request.get_json() or {}
+    return jsonify(recommend(data))
@@ -0,0 +1,100 @@
+"""
+GET /api/sync?since=<token>: what changed in the caller's dashboard lists
+since their last sync.
+
+    -> {"reports": [...], "videos": [...], "vouchers": [...],    # users
+        "pending_reports": [...], "pending_uploads": [...],      # government
+        "removed": {"reports": ["<id>", ...], ...},
+        "user": {...}, "leaderboard": [...],
+        "token": "<next since>", "full": false}
+
+Without `since`, or with a token too old for the tombstones (changes.py),
+every list is sent whole with "full": true and the client replaces its
+lists. Otherwise the lists hold only documents created or modified since
+the token, to be upserted by id, and "removed" the ids that left each list
+(deleted, or no longer pending for the review queues). Tokens are rewound
+by SYNC_OVERLAP seconds, so a few documents may be sent twice.
+"""
+from datetime import datetime
+from bson import ObjectId
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt
+from pagination import sort_spec
+from serializers import (report as _pub_report, upload as _pub_upload, voucher as _pub_voucher,
+                         user as _pub_user, upload_base, USER_FIELDS)
+from changes import (FIELDS, lists, decode_since, next_token, expired, changed_query, left_query,
+                     tombstone_query, removed_ids)
+from blueprints.dashboard import POOL
+from blueprints.gamification import leaderboard_top
+from errors import ApiError
+
+bp = Blueprint("sync", __name__)
+
+
+def parse_since(token, now):
+    """Start of a delta sync from the `since` token; None for a full one (no token, or too old)"""
+    try:
+        since = decode_since(token) if token else None
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    if since is not None and expired(since, now):
+        return None
+    return since
+
+
+def sync_queries(db, uid, government, since, base):
+    """
+    (list specs, {part: function running its query}) of a sync, `base` the
+    upload URL prefix. Shared with asgi.py, like sync_payload().
+    """
+    serialize = {
+        "reports": _pub_report,
+        "uploads": lambda d: _pub_upload(d, base),
+        "voucher_redemptions": _pub_voucher,
+    }
+    specs = lists(uid, government)
+
+    def listing(collection, query, direction):
+        return [serialize[collection](d)
+                for d in db[collection].find(query, FIELDS[collection]).sort(sort_spec(direction))]
+
+    out = {
+        "user": lambda: db.users.find_one({"_id": uid}, USER_FIELDS),
+        "leaderboard": lambda: leaderboard_top(db),
+    }
+    for name, collection, scope, member, direction in specs:
+        query = changed_query(scope, member, since)
+        out[name] = lambda c=collection, q=query, d=direction: listing(c, q, d)
+        left = left_query(scope, member, since) if since is not None else None
+        if left:
+            out["left:" + name] = lambda c=collection, q=left: list(db[c].find(q, {"_id": 1}))
+    if since is not None:
+        out["tombstones"] = lambda: list(db.tombstones.find(
+            tombstone_query(specs, since), {"collection": 1, "doc_id": 1, "user_id": 1, "status": 1}))
+    return specs, out
+
+
+def sync_payload(out, specs, since, now, overlap):
+    """Response body from the results of sync_queries()"""
+    if not out["user"]:
+        raise ApiError(404, "not found")
+    left = {name: out.pop("left:" + name, ()) for name, *_ in specs}
+    out["removed"] = removed_ids(specs, out.pop("tombstones", ()), left) if since is not None else {}
+    out["user"] = _pub_user(out["user"])
+    out["token"] = next_token(now, overlap)
+    out["full"] = since is None
+    return out
+
+
+@bp.route("/sync", methods=["GET"])
+@jwt_required()
+def sync():
+    claims = get_jwt()
+    now = datetime.utcnow()
+    since = parse_since(request.args.get("since"), now)
+    specs, parts = sync_queries(current_app.db, ObjectId(claims["sub"]), claims.get("role") == "government",
+                           since, upload_base())
+    # same pool as /api/dashboard: one round trip's latency instead of one per query
+    futures = {name: POOL.submit(fn) for name, fn in parts.items()}
+    out = {name: f.result() for name, f in futures.items()}
+    return jsonify(sync_payload(out, specs, since, now, current_app.config["SYNC_OVERLAP"]))
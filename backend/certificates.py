@@ -0,0 +1,395 @@
+"""
+Compliance certificate PDFs, rendered once per approved report.
+
+An approved report's certificate is written to CERT_DIR under a name
+derived from everything the PDF shows plus TEMPLATE_VERSION and the
+ReportLab version, so the file is re-rendered only when one of those
+changes. The name is an HMAC keyed with the app secret because /certs/
+serves CERT_DIR without authentication: it cannot be guessed from the
+report. The issue date printed in the footer is the approval time, not
+the render time.
+
+Pages are the static part of the certificate (static_page(), built once
+per template version) with the report's fields drawn over it.
+
+Approval starts the render in the background (JOBS tracks the renders in
+flight in this process), so the PDF is usually on disk before the first
+download asks for it.
+
+archive() streams many certificates as one ZIP, rendering the missing ones
+on a process pool (see blueprints/compliance.export_certificates).
+
+    python certificates.py --prune   # delete files no approved report uses
+"""
+import contextlib
+import functools
+import hashlib
+import hmac
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED
+from datetime import datetime
+from io import BytesIO
+from bson import ObjectId
+import reportlab
+from reportlab import rl_config
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.colors import HexColor
+
+# bump whenever draw_static() or draw_fields() change what they draw
+TEMPLATE_VERSION = 2
+
+# plain Flate streams: ReportLab's ASCII85 pass over them (pure Python here)
+# costs about as much as drawing the page, and makes the file a quarter larger
+rl_config.useA85 = 0
+
+
+def issued_at(report):
+    """Issue date printed on the certificate: frozen at approval"""
+    return report.get("approved_at") or datetime.utcnow()
+
+
+# fonts the page uses, registered in this order on every canvas so the
+# resource names (/F1, /F2) in the prebuilt static page stay valid
+FONTS = ("Helvetica", "Helvetica-Bold")
+BRAND = HexColor("#2d6a4f")
+BRAND2 = HexColor("#40916c")
+LINE = HexColor("#d8f3dc")
+TEXT = HexColor("#1b4332")
+
+# (label, label x, value x, y from the top)
+FIELDS = [
+    ("Project:", 30*mm, 60*mm, 65*mm),
+    ("Applicant:", 30*mm, 60*mm, 75*mm),
+    ("Selected Species:", 30*mm, 80*mm, 85*mm),
+    ("Location:", 30*mm, 60*mm, 95*mm),
+]
+
+
+def field_values(report):
+    return [report.get("project_name",""), report.get("username",""), report.get("species_choice",""),
+            f"Lat {report.get('lat')}, Lon {report.get('lon')}"]
+
+
+def draw_static(c):
+    """Everything on the page that is the same for every certificate"""
+    W,H = A4
+
+    # Draw border
+    c.setStrokeColor(LINE)
+    c.setLineWidth(3)
+    c.rect(12*mm, 12*mm, W-24*mm, H-24*mm)
+
+    # Title
+    c.setFillColor(BRAND)
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(30*mm, H-40*mm, "Verdantia Green Compliance Certificate")
+    c.setFillColor(BRAND2)
+    c.setFont("Helvetica", 12)
+    c.drawString(30*mm, H-47*mm, "AI-powered Afforestation Planner")
+
+    # Project details labels
+    c.setFillColor(BRAND)
+    c.setFont("Helvetica-Bold", 14)
+    for label, x, _, y in FIELDS:
+        c.drawString(x, H-y, label)
+
+    # Planting guidance
+    c.drawString(30*mm, H-110*mm, "Planting Location Guidance")
+    c.setFillColor(TEXT)
+    c.setFont("Helvetica", 11)
+    guidance = [
+        "Plant approved species within the project boundary at provided coordinates.",
+        "Prioritize perimeters, open courtyards, and contour lines.",
+        "Maintain mixed clusters with ~1600 saplings/ha for rapid canopy and resilience.",
+        "Use mulching & rainwater harvesting to sustain growth during dry months."
+    ]
+    y = H-120*mm
+    for line_txt in guidance:
+        c.drawString(30*mm, y, line_txt)
+        y -= 7*mm
+
+    # Footer rule
+    c.setStrokeColor(LINE)
+    c.line(30*mm, 30*mm, W-30*mm, 30*mm)
+
+
+def draw_fields(c, report):
+    """The per-report strings: field values and the issue date"""
+    W,H = A4
+    c.setFillColor(TEXT)
+    c.setFont("Helvetica", 12)
+    for (_, _, x, y), value in zip(FIELDS, field_values(report)):
+        c.drawString(x, H-y, value)
+
+    # Footer
+    c.setFillColor(BRAND2)
+    c.setFont("Helvetica", 10)
+    footer_text = "Issued by: Government Authority via Verdantia · "+ issued_at(report).strftime("%Y-%m-%d %H:%M UTC")
+    c.drawString(30*mm, 25*mm, footer_text)
+
+
+def new_canvas(buffer, invariant=False):
+    c = canvas.Canvas(buffer, pagesize=A4, invariant=int(invariant), pageCompression=1)
+    for font in FONTS:
+        c.setFont(font, 12)
+    return c
+
+
+def content_stream(draw):
+    """
+    PDF page operators drawn by draw(canvas), fonts named as in FONTS; for
+    replaying with addLiteral() or writing pages without a canvas (summary.py)
+    """
+    c = new_canvas(BytesIO())
+    start = len(c._code)
+    draw(c)
+    # q/Q keeps its colours and line width from leaking into what follows
+    return "\n".join(["q", *c._code[start:], "Q"])
+
+
+@functools.lru_cache(maxsize=None)
+def static_page(version):
+    """PDF content stream of draw_static(), built once per template version"""
+    return content_stream(draw_static)
+
+
+def draw_certificate(buffer, report, invariant=False, overlay=True):
+    """
+    Generate PDF certificate for approved compliance report. With invariant
+    set the output is byte-for-byte reproducible (fixed creation date and
+    document id), as cached files need.
+
+    By default the static page is copied from static_page() and only the
+    report's fields are drawn over it; overlay=False draws the whole page
+    (see bench/certificates.py).
+    """
+    c = new_canvas(buffer, invariant)
+    if overlay:
+        c.addLiteral(static_page(TEMPLATE_VERSION))
+    else:
+        draw_static(c)
+    draw_fields(c, report)
+    c.showPage()
+    c.save()
+
+
+def certificate_key(report, secret):
+    """Content address of the report's certificate (also its strong ETag)"""
+    # approved_at to the millisecond: the precision Mongo stores, so a report
+    # document built at approval and the one read back later agree
+    shown = [TEMPLATE_VERSION, reportlab.Version, report.get("project_name", ""), report.get("username", ""),
+             report.get("species_choice", ""), report.get("lat"), report.get("lon"),
+             issued_at(report).isoformat(timespec="milliseconds")]
+    return hmac.new(secret.encode(), repr(shown).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def path_of(key, cert_dir):
+    return os.path.join(cert_dir, key + ".pdf")
+
+
+def cached(report, cert_dir, secret):
+    """(filename in cert_dir, key) of an approved report's certificate, rendering it if missing."""
+    key = certificate_key(report, secret)
+    name = key + ".pdf"
+    path = path_of(key, cert_dir)
+    if not os.path.exists(path):
+        # rendered beside the target and renamed, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=cert_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                draw_certificate(out, report, invariant=True)
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+    return name, key
+
+
+class RenderJobs:
+    """Background renders in flight in this process, by certificate key."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, key, submit):
+        """Call submit() (returns a future running cached()) unless `key` is already being rendered."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.done():
+                return job
+            job = self._jobs[key] = submit()
+        # outside the lock: an already finished future runs the callback right away
+        job.add_done_callback(lambda f: self._finished(key, f))
+        return job
+
+    def get(self, key):
+        """The running render of `key`, or None"""
+        job = self._jobs.get(key)
+        return job if job is not None and not job.done() else None
+
+    def _finished(self, key, job):
+        with self._lock:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+        if not job.cancelled() and job.exception() is not None:
+            print(f"✗ Certificate render failed: {job.exception()}")
+
+
+JOBS = RenderJobs()
+
+
+def render(report):
+    """PDF bytes of a certificate that is not cached (report not approved)"""
+    buf = BytesIO()
+    draw_certificate(buf, report, invariant=True)
+    return buf.getvalue()
+
+
+def export_filter(status="Approved", since=None, until=None, user=None):
+    """
+    (query, sort field) of the reports to export: `status` reports (any if
+    None) issued (approved, or else created) in [since, until), ISO dates,
+    of `user` (username or user id). ValueError on bad arguments.
+    """
+    if status not in (None, "Approved", "Pending"):
+        raise ValueError("status must be Approved or Pending")
+    field = "approved_at" if status == "Approved" else "created_at"
+    query = {"status": status} if status else {}
+    try:
+        bounds = {op: datetime.fromisoformat(v) for op, v in (("$gte", since), ("$lt", until)) if v}
+    except ValueError:
+        raise ValueError("from / to must be ISO dates") from None
+    if bounds:
+        query[field] = bounds
+    if user:
+        query["$or"] = [{"username": user}] + ([{"user_id": ObjectId(user)}] if ObjectId.is_valid(user) else [])
+    return query, field
+
+
+# the report fields draw_certificate() and certificate_key() use
+EXPORT_FIELDS = {"project_name": 1, "username": 1, "species_choice": 1, "lat": 1, "lon": 1,
+                 "status": 1, "approved_at": 1}
+
+
+def archive_name(report):
+    return f"certificate_{report['_id']}.pdf"
+
+
+def export_job(report, cert_dir, secret):
+    """
+    (result, None) when the certificate is on disk, else (None, (fn, *args))
+    to run in the process pool; the result goes to ZipStream.add().
+    """
+    if report.get("status") == "Approved":
+        key = certificate_key(report, secret)
+        if os.path.exists(path_of(key, cert_dir)):
+            return (key + ".pdf", key), None
+        return None, (cached, report, cert_dir, secret)
+    return None, (render, report)
+
+
+class ZipStream:
+    """
+    ZIP archive written to memory entry by entry; add() and close() return
+    the bytes written since the previous call, so only one entry is held at
+    a time. Stored, not deflated: the PDFs are compressed already.
+    """
+
+    def __init__(self, cert_dir):
+        self.cert_dir = cert_dir
+        self._chunks = []
+        # no tell()/seek(): zipfile writes sizes after each entry instead
+        self._zip = zipfile.ZipFile(self, "w", zipfile.ZIP_STORED)
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def add(self, name, result):
+        """Add a render result: PDF bytes, or (file name, key) of a cached file"""
+        if isinstance(result, bytes):
+            self._zip.writestr(name, result)
+        else:
+            self._zip.write(os.path.join(self.cert_dir, result[0]), name)
+        return self._take()
+
+    def close(self):
+        self._zip.close()
+        return self._take()
+
+    def _take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def archive(reports, cert_dir, secret, submit, window):
+    """
+    Yield a ZIP of the certificates of `reports` as it is written. Missing
+    ones are rendered with submit(fn, *args), at most `window` at a time,
+    and added in the order they finish.
+    """
+    out = ZipStream(cert_dir)
+    running = {}
+    try:
+        for report in reports:
+            result, job = export_job(report, cert_dir, secret)
+            if job is None:
+                yield out.add(archive_name(report), result)
+                continue
+            running[submit(*job)] = archive_name(report)
+            while len(running) >= window:
+                yield from _finished(out, running)
+        while running:
+            yield from _finished(out, running)
+        yield out.close()
+    finally:
+        # client gone or a render failed: drop what has not started yet
+        for job in running:
+            job.cancel()
+
+
+def _finished(out, running):
+    done, _ = wait(running, return_when=FIRST_COMPLETED)
+    for job in done:
+        yield out.add(running.pop(job), job.result())
+
+
+def prune(db, cert_dir, secret):
+    """Delete cached certificates that no approved report maps to; returns how many."""
+    keep = {certificate_key(r, secret) + ".pdf" for r in db.reports.find({"status": "Approved"})}
+    removed = 0
+    for name in os.listdir(cert_dir):
+        if name.endswith(".pdf") and name not in keep:
+            os.remove(os.path.join(cert_dir, name))
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Certificate cache maintenance.")
+    parser.add_argument("--prune", action="store_true", help="delete cached certificates no approved report uses")
+    args = parser.parse_args()
+    if not args.prune:
+        parser.error("nothing to do")
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/verdantia"))
+    mongo_db = os.getenv("MONGO_DB")
+    db = client[mongo_db] if mongo_db else client.get_default_database("verdantia")
+    cert_dir = os.getenv("CERT_DIR", "certs")
+    print(f"✓ Removed {prune(db, cert_dir, os.getenv('JWT_SECRET_KEY', 'dev-secret-change-me'))} certificates")
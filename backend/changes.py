@@ -0,0 +1,99 @@
+"""
+Change tracking behind /api/sync (blueprints/sync.py).
+
+reports, uploads and voucher_redemptions carry an `updated_at` that every
+write sets, and the delete routes leave a tombstone (collection, document
+id, owner and status at deletion) in `tombstones`. Tombstones expire after
+TOMBSTONE_DAYS (indexes.py); a sync token older than that gets a full
+resync instead of a delta.
+
+Documents written before updated_at existed have none: they are sent by
+full syncs and get one on their next change.
+"""
+import base64
+from datetime import datetime, timedelta
+from indexes import TOMBSTONE_DAYS
+from serializers import REPORT_FIELDS, UPLOAD_FIELDS, VOUCHER_FIELDS
+
+FIELDS = {"reports": REPORT_FIELDS, "uploads": UPLOAD_FIELDS, "voucher_redemptions": VOUCHER_FIELDS}
+
+
+def tombstone(collection, doc):
+    """Tombstone for `doc`, deleted from `collection`; insert it after the delete."""
+    return {
+        "collection": collection,
+        "doc_id": doc["_id"],
+        "user_id": doc.get("user_id"),
+        "status": doc.get("status"),
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def encode_since(when):
+    return base64.urlsafe_b64encode(when.isoformat().encode()).decode().rstrip("=")
+
+
+def decode_since(token):
+    """datetime from a sync token, ValueError if malformed"""
+    try:
+        return datetime.fromisoformat(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid sync token") from e
+
+
+def next_token(now, overlap):
+    # rewound so writes still in flight on other workers are picked up next time
+    return encode_since(now - timedelta(seconds=overlap))
+
+
+def expired(since, now):
+    """True when tombstones newer than `since` may already be gone"""
+    return since <= now - timedelta(days=TOMBSTONE_DAYS)
+
+
+def lists(uid, government):
+    """
+    [(name, collection, scope, member, direction)] synced for the caller:
+    documents in `scope` matching `member` form the list, in created_at
+    order `direction` (the dashboard lists).
+    """
+    if government:
+        pending = {"status": "Pending"}
+        return [("pending_reports", "reports", {}, pending, 1),
+                ("pending_uploads", "uploads", {}, pending, 1)]
+    mine = {"user_id": uid}
+    return [("reports", "reports", mine, {}, -1),
+            ("videos", "uploads", mine, {}, -1),
+            ("vouchers", "voucher_redemptions", mine, {}, -1)]
+
+
+def changed_query(scope, member, since=None):
+    """List members (created or modified after `since`)"""
+    query = {**scope, **member}
+    if since is not None:
+        query["updated_at"] = {"$gt": since}
+    return query
+
+
+def left_query(scope, member, since):
+    """Documents modified after `since` that are no longer members; None if only deletion removes them"""
+    if not member:
+        return None
+    return {**scope, "updated_at": {"$gt": since}, "$nor": [member]}
+
+
+def tombstone_query(specs, since):
+    """Tombstones after `since` of documents that were members of any of the lists"""
+    return {"updated_at": {"$gt": since}, "$or": [
+        {"collection": collection, **scope, **member} for _, collection, scope, member, _ in specs
+    ]}
+
+
+def removed_ids(specs, tombstones, left):
+    """{list name: [id]} from tombstone documents and {list name: documents that left it}"""
+    out = {name: [str(d["_id"]) for d in left.get(name, ())] for name, *_ in specs}
+    for t in tombstones:
+        for name, collection, scope, member, _ in specs:
+            if t["collection"] == collection and all(t.get(k) == v for k, v in {**scope, **member}.items()):
+                out[name].append(str(t["doc_id"]))
+    return out
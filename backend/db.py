@@ -0,0 +1,122 @@
+"""
+Lazy database handle used as app.db.
+
+The connection (client creation, ping, fallbacks, index bootstrap) runs in a
+background thread started by create_app(), so the app can accept traffic
+immediately. The first request that touches app.db waits for that
+in-progress attempt (up to MONGO_CONNECT_WAIT seconds) instead of starting a
+new one; after a failed attempt the next use starts a fresh one.
+
+MongoClient is not fork-safe: under `gunicorn --preload` the master sets
+MONGO_DEFER_CONNECT so it never connects, and each worker calls reset() from
+post_fork to get its own client (see gunicorn.conf.py).
+"""
+import os
+import threading
+from pymongo.errors import PyMongoError
+
+
+def is_production():
+    # Render sets RENDER; render.yaml also sets PYTHON_ENV=production
+    return bool(os.getenv("RENDER", False) or os.getenv("PYTHON_ENV") == "production")
+
+
+def pool_options(production):
+    """
+    Connection pool sizing, overridable per environment:
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS.
+    """
+    opts = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 10)),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 1)),
+    }
+    wait_ms = os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000" if production else "")
+    if wait_ms:
+        opts["waitQueueTimeoutMS"] = int(wait_ms)
+    return opts
+
+
+class DatabaseUnavailable(PyMongoError):
+    """The database connection is not (yet) established."""
+
+
+class LazyDatabase:
+    def __init__(self, connect, wait=30):
+        """`connect` returns (client, db) and may block; `wait` bounds how long users wait."""
+        self._connect = connect
+        self._wait = wait
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._client = None
+        self._db = None
+        self.error = None
+
+    def start(self):
+        """Start a connection attempt unless one is running or already succeeded."""
+        with self._lock:
+            if self._db is not None or (self._thread and self._thread.is_alive()):
+                return
+            self._ready.clear()
+            self.error = None
+            self._thread = threading.Thread(target=self._run, name="mongo-connect", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self._client, self._db = self._connect()
+        except Exception as e:
+            print(f"✗ Database connection failed: {e}")
+            self.error = e
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self):
+        return self._db is not None
+
+    def get(self, wait=None):
+        """The pymongo Database, waiting for the current attempt if needed."""
+        if self._db is not None:
+            return self._db
+        self.start()
+        if not self._ready.wait(self._wait if wait is None else wait):
+            raise DatabaseUnavailable("database connection in progress")
+        if self._db is None:
+            raise DatabaseUnavailable(f"database unavailable: {self.error}")
+        return self._db
+
+    def reset(self):
+        """
+        Drop whatever was inherited from the parent process and reconnect.
+        The inherited client is abandoned, not closed: its sockets are shared
+        with the parent.
+        """
+        self._init_state()
+        self.start()
+
+    def join(self):
+        """
+        Block until the current (or a new) attempt finishes; the Database, or
+        DatabaseUnavailable with that attempt's error (no retry is started).
+        """
+        self.start()
+        self._ready.wait()
+        if self._db is None:
+            raise DatabaseUnavailable(f"database unavailable: {self.error}")
+        return self._db
+
+    @property
+    def client(self):
+        self.get()
+        return self._client
+
+    def __getattr__(self, name):
+        # app.db.reports, app.db.command(...), ...
+        return getattr(self.get(), name)
+
+    def __getitem__(self, name):
+        return self.get()[name]
@@ -0,0 +1,230 @@
+"""
+Mongo command monitoring.
+
+CommandMonitor is passed to MongoClient(event_listeners=...) in _init_db().
+Every command is timed and attributed to the Flask route that issued it
+(listeners run on the issuing thread). Commands slower than MONGO_SLOW_MS
+are logged with the shape of their filter (values replaced by "?").
+Durations feed the mongodb_command_duration_seconds histogram on /metrics.
+
+Outside production, responses carry the per-request round trips and DB time
+(`X-DB-Queries`, `Server-Timing: db;dur=<ms>`), which makes N+1 patterns such
+as a find followed by an update easy to spot.
+
+POOL (a ConnectionPoolListener) tracks checked-out connections, the wait
+queue and checkout wait time. With MONGO_ADMISSION_MAX_WAITERS set, API
+requests are refused with 503 + Retry-After while that many threads are
+already waiting for a connection, instead of queueing behind them.
+"""
+import json
+import logging
+import threading
+import time
+from flask import g, request, has_request_context, jsonify
+from pymongo import monitoring
+from pymongo.errors import WaitQueueTimeoutError
+from metrics import register, Histogram, Gauge, Counter
+
+log = logging.getLogger(__name__)
+
+DB_LATENCY = register(Histogram(
+    "mongodb_command_duration_seconds", "Mongo command latency by issuing route.",
+    ("command", "collection", "blueprint", "rule")))
+
+# handshake / housekeeping commands, not issued by routes
+_IGNORED = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildinfo"}
+
+# where each command keeps its filter
+_FILTER_PATHS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "aggregate": ("pipeline",),
+    "update": ("updates", "q"),
+    "delete": ("deletes", "q"),
+}
+
+
+def shape(value):
+    """Structure of a filter without its values: {"user_id": "?", "created_at": {"$lt": "?"}}"""
+    if isinstance(value, dict):
+        return {k: shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [shape(v) for v in value[:1]]
+    return "?"
+
+
+def _filter_shape(name, command):
+    path = _FILTER_PATHS.get(name)
+    if not path:
+        return None
+    value = command.get(path[0])
+    if len(path) > 1 and value:
+        # bulk update/delete: shape of the first statement
+        value = value[0].get(path[1])
+    return shape(value) if value is not None else None
+
+
+def _collection(command_name, command):
+    """Collection a command runs on; "" when the command does not name one"""
+    # getMore's own field is the cursor id, a new label set per batch
+    name = command.get("collection" if command_name == "getMore" else command_name)
+    return name if isinstance(name, str) else ""
+
+
+def _route():
+    if not has_request_context():
+        return "", ""
+    return request.blueprint or "", request.url_rule.rule if request.url_rule else ""
+
+
+class CommandMonitor(monitoring.CommandListener):
+    def __init__(self, slow_ms=100):
+        self.slow_ms = slow_ms
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in _IGNORED:
+            return
+        cmd = event.command
+        info = (_collection(event.command_name, cmd), _filter_shape(event.command_name, cmd))
+        with self._lock:
+            self._started[(event.request_id, event.connection_id)] = info
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "failed")
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            info = self._started.pop((event.request_id, event.connection_id), None)
+        if info is None:
+            return
+        collection, filter_shape = info
+        ms = event.duration_micros / 1000
+        blueprint, rule = _route()
+        DB_LATENCY.observe((event.command_name, collection, blueprint, rule), ms / 1000)
+        if has_request_context():
+            # locked: /api/dashboard runs several queries of one request concurrently
+            with self._lock:
+                g.db_round_trips = g.get("db_round_trips", 0) + 1
+                g.db_time_ms = g.get("db_time_ms", 0.0) + ms
+        if ms >= self.slow_ms:
+            log.warning("slow mongo %s %s.%s %.1fms (%s) route=%s filter=%s",
+                        outcome, event.database_name, collection, ms, event.command_name,
+                        rule or "-", json.dumps(filter_shape))
+
+
+POOL_CHECKED_OUT = register(Gauge(
+    "mongodb_pool_checked_out", "Connections currently checked out of the pool.", ("address",)))
+POOL_WAITING = register(Gauge(
+    "mongodb_pool_wait_queue", "Threads waiting to check out a connection.", ("address",)))
+POOL_WAIT = register(Histogram(
+    "mongodb_pool_wait_seconds", "Time spent waiting for a pool connection.", ("address",),
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0)))
+POOL_CHECKOUT_FAILED = register(Counter(
+    "mongodb_pool_checkout_failed_total", "Failed connection checkouts by reason.", ("address", "reason")))
+ADMISSION_REJECTED = register(Counter(
+    "http_requests_shed_total", "API requests refused by admission control.", ("blueprint",)))
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.waiting = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _address(self, event):
+        return "%s:%s" % event.address
+
+    def _wait_done(self, event):
+        address = self._address(event)
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        with self._lock:
+            self.waiting -= 1
+        POOL_WAITING.dec((address,))
+        if started is not None:
+            POOL_WAIT.observe((address,), time.perf_counter() - started)
+        return address
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        POOL_WAITING.inc((self._address(event),))
+
+    def connection_checked_out(self, event):
+        POOL_CHECKED_OUT.inc((self._wait_done(event),))
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUT_FAILED.inc((self._wait_done(event), str(event.reason)))
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.dec((self._address(event),))
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+POOL = PoolMonitor()
+
+
+def _busy(retry_after):
+    resp = jsonify(msg="database busy, please retry")
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+def init_db_monitoring(app):
+    """
+    Admission control for blueprint routes, 503 on pool wait-queue timeouts,
+    and per-request DB round trips / time headers (non-production only).
+    """
+    max_waiters = app.config["MONGO_ADMISSION_MAX_WAITERS"]
+    retry_after = app.config["MONGO_ADMISSION_RETRY_AFTER"]
+
+    if max_waiters:
+        @app.before_request
+        def _admission_control():
+            # only API routes touch Mongo; /health and /metrics stay reachable
+            if request.blueprint and POOL.waiting >= max_waiters:
+                ADMISSION_REJECTED.inc((request.blueprint,))
+                return _busy(retry_after)
+
+    @app.errorhandler(WaitQueueTimeoutError)
+    def _pool_timeout(e):
+        return _busy(retry_after)
+
+    if not app.config["DB_TIMING_HEADERS"]:
+        return
+
+    @app.after_request
+    def _db_timing_headers(response):
+        trips = g.get("db_round_trips", 0)
+        response.headers["X-DB-Queries"] = str(trips)
+        response.headers.add("Server-Timing", f'db;dur={g.get("db_time_ms", 0.0):.2f};desc="{trips} queries"')
+        return response
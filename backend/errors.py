@@ -0,0 +1,16 @@
+"""
+Error of the route logic shared by the Flask blueprints and the ASGI app
+(asgi.py): each front-end registers a handler that answers it with
+{field: msg} and the status, so the shared functions stay framework-free.
+"""
+
+
+class ApiError(Exception):
+    def __init__(self, status, msg, field="msg"):
+        super().__init__(msg)
+        self.status = status
+        self.msg = msg
+        self.field = field
+
+    def body(self):
+        return {self.field: self.msg}
@@ -0,0 +1,63 @@
+"""
+Gunicorn configuration: `gunicorn -c gunicorn.conf.py app:app`
+
+Profiles (GUNICORN_PROFILE):
+- sync (default): WEB_CONCURRENCY sync workers, one request each.
+- threaded: gthread workers with GUNICORN_THREADS threads each, for routes
+  that mostly wait on Mongo.
+
+The app is preloaded in the master (GUNICORN_PRELOAD, default on) so imported
+code such as reportlab is shared copy-on-write; gc.freeze() keeps the garbage
+collector from touching (and un-sharing) those pages. The master never
+connects to Mongo; every worker gets its own client and ledger compactor
+thread in post_fork.
+
+Each worker's Mongo pool is sized to every thread that can hold a
+connection at once (see below) unless MONGO_MAX_POOL_SIZE is set, so
+workers x pool stays predictable.
+"""
+import gc
+import os
+
+profile = os.getenv("GUNICORN_PROFILE", "sync")
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+accesslog = "-"
+
+if profile == "threaded":
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", 8))
+else:
+    worker_class = "sync"
+    threads = 1
+
+# a connection per request thread and per thread of the per-process
+# fan-out pools (dashboard / sync queries, parallel batch GETs; request
+# threads hold none while they wait on those), plus the ledger compactor
+# and the background connect
+fan_out = int(os.getenv("DASHBOARD_WORKERS", 8)) + int(os.getenv("BATCH_WORKERS", 8))
+os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(threads + fan_out + 2))
+os.environ.setdefault("MONGO_MIN_POOL_SIZE", "1")
+if preload_app:
+    os.environ["MONGO_DEFER_CONNECT"] = "true"
+
+
+def when_ready(server):
+    pool = int(os.environ["MONGO_MAX_POOL_SIZE"])
+    server.log.info("profile=%s workers=%d threads=%d mongo pool/worker=%d (max %d connections)",
+                    profile, workers, threads, pool, workers * pool)
+    if preload_app:
+        # move everything imported so far into the permanent generation so
+        # collections in the workers don't write to the shared pages
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app import app
+        app.db.reset()
+        app.ledger.start()
@@ -0,0 +1,166 @@
+"""
+Index declarations for every collection the blueprints query.
+
+Used at startup by create_app() and as a management command:
+
+    python indexes.py            # build / migrate indexes
+    python indexes.py --dry-run  # only print what would change
+"""
+import os
+import argparse
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+PENDING = {"status": "Pending"}
+
+# how long deletions are remembered for /api/sync (see changes.py)
+TOMBSTONE_DAYS = 30
+
+INDEXES = {
+    "users": [
+        # auth.register / auth.login lookups
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # gamification.leaderboard pages and leaderboard_me counts; role is in
+        # the key so the role != government filter needs no document fetch
+        IndexModel([("points", DESCENDING), ("_id", DESCENDING), ("role", ASCENDING)], name="points_id_role"),
+    ],
+    "reports": [
+        # compliance.my_reports (keyset order, see pagination.py)
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_created"),
+        # compliance.admin_pending
+        IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="pending_created",
+                   partialFilterExpression=PENDING),
+        # compliance.compliance_check duplicate guard
+        IndexModel([("user_id", ASCENDING), ("project_name", ASCENDING)], name="pending_user_project",
+                   partialFilterExpression=PENDING),
+        # sync deltas: the owner's changes, and the review queue's
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING)], name="user_updated"),
+        IndexModel([("updated_at", ASCENDING)], name="updated"),
+    ],
+    "uploads": [
+        # gamification.my_videos
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_created"),
+        # gamification.admin_uploads_pending
+        IndexModel([("created_at", ASCENDING), ("_id", ASCENDING)], name="pending_created",
+                   partialFilterExpression=PENDING),
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING)], name="user_updated"),
+        IndexModel([("updated_at", ASCENDING)], name="updated"),
+    ],
+    "tombstones": [
+        # sync deltas; also expires tombstones after TOMBSTONE_DAYS
+        IndexModel([("updated_at", ASCENDING)], name="expire", expireAfterSeconds=TOMBSTONE_DAYS * 86400),
+    ],
+    "points_windows": [
+        # leaderboard.window_updates upserts
+        IndexModel([("period", ASCENDING), ("start", ASCENDING), ("user_id", ASCENDING)],
+                   name="bucket_user", unique=True),
+        # gamification.leaderboard?period=week|month
+        IndexModel([("period", ASCENDING), ("start", ASCENDING), ("points", DESCENDING), ("user_id", DESCENDING)],
+                   name="bucket_points"),
+    ],
+    "points_ledger": [
+        # ledger.settle (balance check on redemption)
+        IndexModel([("user_id", ASCENDING)], name="user_pending", partialFilterExpression={"applied": False}),
+        # ledger.compact batch claims and crash recovery
+        IndexModel([("batch", ASCENDING)], name="pending_batch", partialFilterExpression={"applied": False}),
+    ],
+    "voucher_redemptions": [
+        # gamification.my_vouchers
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                   name="user_created"),
+        IndexModel([("user_id", ASCENDING), ("updated_at", ASCENDING)], name="user_updated"),
+        # gamification.redeem retries (one redemption per ledger entry)
+        IndexModel([("user_id", ASCENDING), ("code", ASCENDING)], name="user_code", unique=True),
+    ],
+}
+
+# Indexes superseded by the declarations above, dropped when present
+RETIRED = {
+    "users": ["points_desc"],  # prefix of points_id_role
+}
+
+# Index options that change index behaviour; anything else reported by
+# index_information() (v, ns, background, ...) is ignored when comparing.
+_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _spec(info):
+    key = info["key"]
+    key = key.items() if hasattr(key, "items") else key
+    key = [(k, int(d) if isinstance(d, (int, float)) else d) for k, d in key]
+    opts = {o: info[o] for o in _OPTIONS if info.get(o) not in (None, False)}
+    return key, opts
+
+
+def _plan(coll, models, retired=()):
+    """Return [(action, name, model_or_None)] needed to bring coll in line with models."""
+    existing = coll.index_information()
+    actions = []
+    for model in models:
+        wanted = _spec(model.document)
+        name = model.document["name"]
+        if name in existing:
+            if _spec(existing[name]) == wanted:
+                continue
+            actions.append(("drop", name, None))
+        else:
+            # same key under another name: either it already matches, or it
+            # would make create_index fail with an options conflict
+            clash = [n for n, info in existing.items()
+                     if n != "_id_" and _spec(info)[0] == wanted[0]]
+            if any(_spec(existing[n]) == wanted for n in clash):
+                continue
+            actions.extend(("drop", n, None) for n in clash)
+        actions.append(("create", name, model))
+    # after the creates, so queries always have an index to use
+    actions.extend(("drop", name, None) for name in retired if name in existing)
+    return actions
+
+
+def ensure_indexes(db, dry_run=False):
+    """
+    Idempotently create (or re-create when the definition changed) the
+    declared indexes. Returns the list of (collection, action, name) taken,
+    or that would be taken when dry_run is set.
+    """
+    changes = []
+    for coll_name, models in INDEXES.items():
+        coll = db[coll_name]
+        try:
+            actions = _plan(coll, models, RETIRED.get(coll_name, ()))
+        except PyMongoError as e:
+            print(f"✗ Could not read indexes of {coll_name}: {e}")
+            continue
+        for action, name, model in actions:
+            changes.append((coll_name, action, name))
+            if dry_run:
+                print(f"[dry-run] {action} {coll_name}.{name}")
+                continue
+            try:
+                if action == "drop":
+                    coll.drop_index(name)
+                else:
+                    coll.create_indexes([model])
+                print(f"✓ {action} {coll_name}.{name}")
+            except PyMongoError as e:
+                # e.g. duplicate usernames already stored prevent username_unique
+                print(f"✗ {action} {coll_name}.{name} failed: {e}")
+    if not changes:
+        print("✓ Indexes up to date")
+    return changes
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the indexes the API routes rely on.")
+    parser.add_argument("--dry-run", action="store_true", help="print what would change without applying it")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/verdantia"))
+    mongo_db = os.getenv("MONGO_DB")
+    db = client[mongo_db] if mongo_db else client.get_default_database("verdantia")
+    ensure_indexes(db, dry_run=args.dry_run)
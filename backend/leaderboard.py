@@ -0,0 +1,245 @@
+"""
+In-memory leaderboard (top LEADERBOARD_SIZE non-government users by points).
+
+The board is loaded from Mongo with a buffer of extra entries below the
+top N and then kept current by update(), which the routes that change
+points (upload approval and deletion, voucher redemption, registration)
+call with the user document as it is after the write. /api/leaderboard
+then never touches Mongo.
+
+Every process keeps its own board, so a change made in another gunicorn
+worker shows up after at most LEADERBOARD_TTL seconds, when the board is
+reloaded. Entries that fall below the lowest loaded score are dropped,
+since users outside the buffer might now rank above them. If too few
+entries are left to fill the top N, the board is reloaded on the next read.
+
+Beyond the top N, the full board is paginated by keyset on (points, _id),
+both descending. Ranks are competition ranks: tied users share a rank and
+the next rank skips ("1, 2, 2, 4"). A user's rank comes from two indexed
+counts (see the users.points_id_role index) rather than a scan.
+
+Weekly and monthly boards are read from points_windows, which has one row
+per (period, bucket start, user) holding the points earned in that bucket.
+Each upload approval $inc-upserts the user's week and month rows, and
+deleting an approved upload takes the points back out of the buckets it
+was approved in. A row lists the ledger keys (see ledger.py) already
+counted in it, so a retried approval or deletion counts once. Windowed totals count points earned; redeeming vouchers
+does not lower them, while the all-time board is the spendable balance.
+
+    python leaderboard.py --rebuild-windows   # recompute from approved uploads
+"""
+import base64
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+from ledger import approve_key
+from versions import bump, key
+
+RANKED = {"role": {"$ne": "government"}}
+ORDER = [("points", -1), ("_id", -1)]
+REVERSE = [("points", 1), ("_id", 1)]
+FIELDS = {"username": 1, "points": 1}
+
+
+def ahead(points, oid):
+    """Filter for users ranked before (points, oid) in board order."""
+    return {"$or": [{"points": {"$gt": points}}, {"points": points, "_id": {"$gt": oid}}]}
+
+
+def behind(points, oid):
+    """Filter for users ranked after (points, oid) in board order."""
+    return {"$or": [{"points": {"$lt": points}}, {"points": points, "_id": {"$lt": oid}}]}
+
+
+def ranked(users, position=0, rank=0, points=None):
+    """
+    [{"rank", "username", "points"}] for users in board order, continuing
+    after the user at `position` (1-based) who had `rank` and `points`.
+    """
+    rows = []
+    for u in users:
+        position += 1
+        p = int(u.get("points", 0))
+        if p != points:
+            rank, points = position, p
+        rows.append({"rank": rank, "username": u.get("username"), "points": p})
+    return rows
+
+
+def encode_position(user, position, rank):
+    raw = f'{int(user.get("points", 0))}|{user["_id"]}|{position}|{rank}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_position(cursor):
+    """(points, _id, position, rank) of the last user on the previous page; ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        points, oid, position, rank = raw.split("|")
+        return int(points), ObjectId(oid), int(position), int(rank)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+PERIODS = ("week", "month")
+
+
+def bucket_start(period, when, ago=0):
+    """Start (UTC, naive) of the week (Monday) or month containing `when`, `ago` buckets back."""
+    day = datetime(when.year, when.month, when.day)
+    if period == "week":
+        return day - timedelta(days=day.weekday(), weeks=ago)
+    months = when.year * 12 + when.month - 1 - ago
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def bucket_end(period, start):
+    if period == "week":
+        return start + timedelta(weeks=1)
+    return bucket_start("month", start + timedelta(days=31))
+
+
+def window_updates(user, amount, when, ref):
+    """
+    points_windows upserts for `amount` points earned (or taken back) by user
+    at `when`, for the ledger entry `ref`. Once `ref` is counted in a row, the
+    upsert for it fails on the bucket_user index instead of counting it again.
+    """
+    return [
+        UpdateOne(
+            {"period": period, "start": bucket_start(period, when), "user_id": user["_id"], "refs": {"$ne": ref}},
+            {"$inc": {"points": amount}, "$set": {"username": user.get("username")}, "$push": {"refs": ref}},
+            upsert=True,
+        )
+        for period in PERIODS
+    ]
+
+
+def window_query(period, start):
+    # rows emptied by a reversal stay behind with 0 points
+    return {"period": period, "start": start, "points": {"$gt": 0}}
+
+
+WINDOW_ORDER = [("points", -1), ("user_id", -1)]
+
+
+def rebuild_windows(db):
+    """Recompute points_windows from approved uploads (first deploy, or after drift)."""
+    totals = {}
+    refs = {}
+    names = {}
+    for up in db.uploads.find({"status": "Approved"}, {"user_id": 1, "points_awarded": 1, "approved_at": 1, "created_at": 1}):
+        when = up.get("approved_at") or up.get("created_at")
+        if not when or not up.get("points_awarded"):
+            continue
+        for period in PERIODS:
+            bucket = (period, bucket_start(period, when), up["user_id"])
+            totals[bucket] = totals.get(bucket, 0) + int(up["points_awarded"])
+            refs.setdefault(bucket, []).append(approve_key(up["_id"]))
+    for u in db.users.find({"_id": {"$in": list({k[2] for k in totals})}}, {"username": 1}):
+        names[u["_id"]] = u.get("username")
+    db.points_windows.delete_many({})
+    if totals:
+        db.points_windows.insert_many([
+            {"period": period, "start": start, "user_id": uid, "username": names.get(uid), "points": points,
+             "refs": refs[(period, start, uid)]}
+            for (period, start, uid), points in totals.items()
+        ])
+    bump(db, key("users"))
+    return len(totals)
+
+
+class Leaderboard:
+    def __init__(self, size=20, ttl=30):
+        self._lock = threading.Lock()
+        self.configure(size, ttl)
+
+    def configure(self, size, ttl):
+        with self._lock:
+            self.size = size
+            self.ttl = ttl
+            self.capacity = size * 2
+            self._entries = {}     # user id -> (points, user id, username)
+            self._floor = None     # lowest score at load; None if every user fits
+            self._loaded_at = None
+            self._top = None       # (rows, tag) built by snapshot()
+
+    @property
+    def fresh(self):
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    def load(self, users):
+        """users: dicts with _id, username, points, best first, at most `capacity` of them."""
+        entries = {u["_id"]: (int(u.get("points", 0)), u["_id"], u.get("username")) for u in users}
+        with self._lock:
+            self._entries = entries
+            full = len(entries) >= self.capacity
+            self._floor = min(e[0] for e in entries.values()) if full else None
+            self._loaded_at = time.monotonic()
+            self._top = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def update(self, user):
+        """Apply a user's new score (the document after the write: _id, username, points, role)."""
+        if not user or self._loaded_at is None:
+            return
+        uid = user["_id"]
+        points = int(user.get("points", 0))
+        with self._lock:
+            self._top = None
+            self._entries.pop(uid, None)
+            if user.get("role") == "government":
+                return
+            if self._floor is None or points > self._floor:
+                self._entries[uid] = (points, uid, user.get("username"))
+            if len(self._entries) > self.capacity:
+                kept = sorted(self._entries.values(), reverse=True)[:self.capacity]
+                self._entries = {e[1]: e for e in kept}
+                self._floor = kept[-1][0]
+            elif self._floor is not None and len(self._entries) < self.size:
+                self._loaded_at = None  # not enough known entries left
+
+    def top(self):
+        """[{"rank", "username", "points"}] for the top `size`; call load() first when not fresh."""
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """(top(), tag) where the tag (an ETag) changes whenever the rows do."""
+        top = self._top
+        if top is None:
+            with self._lock:
+                best = sorted(self._entries.values(), reverse=True)[:self.size]
+                rows = ranked({"username": name, "points": points} for points, _, name in best)
+                top = self._top = (rows, hashlib.sha1(repr(rows).encode()).hexdigest()[:20])
+        return top
+
+
+LEADERBOARD = Leaderboard()
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Leaderboard maintenance.")
+    parser.add_argument("--rebuild-windows", action="store_true",
+                        help="recompute weekly / monthly totals from approved uploads")
+    args = parser.parse_args()
+    if not args.rebuild_windows:
+        parser.error("nothing to do")
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/verdantia"))
+    mongo_db = os.getenv("MONGO_DB")
+    db = client[mongo_db] if mongo_db else client.get_default_database("verdantia")
+    print(f"✓ Rebuilt {rebuild_windows(db)} window rows")
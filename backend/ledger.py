@@ -0,0 +1,253 @@
+"""
+Append-only points ledger.
+
+Every change to a user's points is one points_ledger document whose _id is
+an idempotency key ("approve:<upload id>", "revoke:<upload id>",
+"redeem:<user id>:<key>"), so a retried or concurrent moderation action is
+recorded, and paid, exactly once.
+
+users.points is a cached balance. Awards and revocations are inserted
+unapplied, and compact() folds them into users.points in batches: one $inc
+per user per batch instead of one per event on popular users. Redemptions
+have to check the balance, so they are held instead: hold() records them out
+of compact()'s reach, and apply_held() deducts them from users.points with
+one conditional $inc, after settle() has folded the user's pending entries
+(the check then reads one number, users.points), and only then marks them
+applied. A held entry that is never applied moves no points.
+
+compact() is safe to run from several processes at once and to re-run
+after a crash: entries are claimed per batch, and each user remembers the
+last KEEP_BATCHES batches already folded into their balance.
+Compactor runs it every LEDGER_COMPACT_INTERVAL seconds in each process.
+
+    python ledger.py --compact   # fold pending entries now
+    python ledger.py --open      # record pre-ledger balances as opening entries (once)
+    python ledger.py --verify    # users whose balance differs from their ledger
+"""
+import os
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from versions import bump, key
+
+KEEP_BATCHES = 20
+
+# batch of entries waiting for apply_held(); compact() and settle() only fold
+# batches they claimed (ObjectIds)
+HELD = "held"
+CLAIMED = {"$type": "objectId"}
+
+
+def approve_key(upload_id):
+    return f"approve:{upload_id}"
+
+
+def revoke_key(upload_id):
+    return f"revoke:{upload_id}"
+
+
+def redeem_key(user_id, key):
+    return f"redeem:{user_id}:{key}"
+
+
+def entry(key, user_id, amount, reason, ref=None, applied=False):
+    return {
+        "_id": key,
+        "user_id": user_id,
+        "amount": int(amount),
+        "reason": reason,
+        "ref": ref,
+        "applied": applied,
+        "batch": None,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def record(db, key, user_id, amount, reason, ref=None, applied=False):
+    """Append an entry; False if `key` was already recorded."""
+    try:
+        db.points_ledger.insert_one(entry(key, user_id, amount, reason, ref, applied))
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def hold(db, key, user_id, amount, reason, ref=None):
+    """Append an entry for apply_held() to apply; False if `key` was already recorded."""
+    e = entry(key, user_id, amount, reason, ref)
+    e["batch"] = HELD
+    try:
+        db.points_ledger.insert_one(e)
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def apply_held(db, key, floor=0, on_update=None):
+    """
+    Apply the held entry `key` to users.points unless that takes the balance
+    below `floor`, then mark it applied. True once applied, by this call or
+    an earlier one that stopped before marking it; False otherwise.
+    """
+    e = db.points_ledger.find_one({"_id": key}, {"user_id": 1, "amount": 1, "applied": 1})
+    if e is None:
+        return False
+    if e["applied"]:
+        return True
+    # like a batch id, the key on the user makes a repeated deduction a no-op
+    u = db.users.find_one_and_update(
+        {"_id": e["user_id"], "ledger_batches": {"$ne": key}, "points": {"$gte": floor - e["amount"]}},
+        {"$inc": {"points": e["amount"]}, "$push": {"ledger_batches": {"$each": [key], "$slice": -KEEP_BATCHES}}},
+        projection={"username": 1, "points": 1, "role": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if u is None:
+        if db.users.count_documents({"_id": e["user_id"], "ledger_batches": key}, limit=1) == 0:
+            return False
+    elif on_update:
+        on_update(u)
+    db.points_ledger.update_one({"_id": key}, {"$set": {"applied": True}})
+    return True
+
+
+def _apply(db, batch, on_update=None):
+    entries = list(db.points_ledger.find({"batch": batch, "applied": False}, {"user_id": 1, "amount": 1}))
+    totals = {}
+    for e in entries:
+        totals[e["user_id"]] = totals.get(e["user_id"], 0) + e["amount"]
+    for uid, total in totals.items():
+        # the batch id on the user makes a repeated fold (crash, concurrent recovery) a no-op
+        u = db.users.find_one_and_update(
+            {"_id": uid, "ledger_batches": {"$ne": batch}},
+            {"$inc": {"points": total}, "$push": {"ledger_batches": {"$each": [batch], "$slice": -KEEP_BATCHES}}},
+            projection={"username": 1, "points": 1, "role": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if u is not None and on_update:
+            on_update(u)
+    db.points_ledger.update_many({"batch": batch}, {"$set": {"applied": True}})
+    if totals:
+        # /api/auth/me of each user and the leaderboards (see versions.py)
+        bump(db, key("users"), *(key("users", uid) for uid in totals))
+    return len(entries)
+
+
+def compact(db, batch_size=500, on_update=None):
+    """Fold unapplied entries into users.points; returns how many were applied."""
+    applied = 0
+    # batches claimed by a run that stopped before marking them applied
+    for batch in db.points_ledger.distinct("batch", {"applied": False, "batch": CLAIMED}):
+        applied += _apply(db, batch, on_update)
+    while True:
+        ids = [e["_id"] for e in db.points_ledger.find({"applied": False, "batch": None}, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        batch = ObjectId()
+        db.points_ledger.update_many({"_id": {"$in": ids}, "batch": None}, {"$set": {"batch": batch}})
+        applied += _apply(db, batch, on_update)
+        if len(ids) < batch_size:
+            break
+    return applied
+
+
+def settle(db, user_id, on_update=None):
+    """
+    Fold the user's unapplied entries into users.points now, so that a
+    balance check can read users.points alone. Includes entries a compactor
+    has claimed but not finished: re-applying its batch is a no-op for the
+    users it already reached.
+    """
+    ids = [e["_id"] for e in db.points_ledger.find({"user_id": user_id, "applied": False, "batch": None}, {"_id": 1})]
+    if ids:
+        db.points_ledger.update_many({"_id": {"$in": ids}, "batch": None}, {"$set": {"batch": ObjectId()}})
+    for batch in db.points_ledger.distinct("batch", {"user_id": user_id, "applied": False, "batch": CLAIMED}):
+        _apply(db, batch, on_update)
+
+
+def open_balances(db):
+    """Opening entries for balances that predate the ledger; returns how many were written."""
+    applied = {r["_id"]: r["total"] for r in db.points_ledger.aggregate([
+        {"$match": {"applied": True}},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}}},
+    ])}
+    opened = 0
+    for u in db.users.find({}, {"points": 1}):
+        amount = int(u.get("points", 0)) - applied.get(u["_id"], 0)
+        if amount and record(db, f"opening:{u['_id']}", u["_id"], amount, "opening_balance", applied=True):
+            opened += 1
+    return opened
+
+
+def verify(db):
+    """[(user id, users.points, sum of applied entries)] where the two disagree."""
+    applied = {r["_id"]: r["total"] for r in db.points_ledger.aggregate([
+        {"$match": {"applied": True}},
+        {"$group": {"_id": "$user_id", "total": {"$sum": "$amount"}}},
+    ])}
+    return [(u["_id"], int(u.get("points", 0)), applied.get(u["_id"], 0))
+            for u in db.users.find({}, {"points": 1})
+            if int(u.get("points", 0)) != applied.get(u["_id"], 0)]
+
+
+class Compactor:
+    """Background compact() loop, one per process (restarted after fork)."""
+
+    def __init__(self, get_db, interval=1.0, batch_size=500, on_update=None):
+        self._get_db = get_db
+        self.interval = interval
+        self.batch_size = batch_size
+        self._on_update = on_update
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="ledger-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                compact(self._get_db(), self.batch_size, self._on_update)
+            except PyMongoError as e:
+                # includes DatabaseUnavailable while the connection is being made
+                print(f"✗ Ledger compaction failed: {e}")
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Points ledger maintenance.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--compact", action="store_true", help="fold pending entries into balances now")
+    group.add_argument("--open", action="store_true", help="record pre-ledger balances as opening entries")
+    group.add_argument("--verify", action="store_true", help="list users whose balance differs from the ledger")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/verdantia"))
+    mongo_db = os.getenv("MONGO_DB")
+    db = client[mongo_db] if mongo_db else client.get_default_database("verdantia")
+    if args.compact:
+        print(f"✓ Applied {compact(db)} entries")
+    elif args.open:
+        print(f"✓ Opened {open_balances(db)} balances")
+    else:
+        mismatches = verify(db)
+        for uid, points, total in mismatches:
+            print(f"✗ {uid}: balance {points}, ledger {total}")
+        if not mismatches:
+            print("✓ All balances match the ledger")
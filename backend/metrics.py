@@ -0,0 +1,178 @@
+"""
+Request metrics in Prometheus text format, served at /metrics.
+
+Per (blueprint, rule, method): latency histogram, status-code counter,
+in-flight gauge and response size histogram. Values live in the worker
+process, so with several gunicorn workers each scrape sees the worker that
+answered it; scrape workers individually or aggregate with sum().
+
+Set METRICS_TOKEN to require `Authorization: Bearer <token>` on /metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, request, g, current_app, jsonify
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v):
+    return "+Inf" if v == float("inf") else repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+    def _samples(self, items):
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one slot per bucket, +Inf, then the running sum
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _samples(self, items):
+        out = []
+        for labels, counts in items:
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = f'le="{_num(bound)}"'
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le)} {running}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {_num(float(counts[-1]))}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {running}")
+        return out
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def expose():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+_ROUTE = ("blueprint", "rule", "method")
+
+REQUEST_LATENCY = register(Histogram(
+    "http_request_duration_seconds", "Request latency until the response body is sent.", _ROUTE))
+REQUESTS = register(Counter(
+    "http_requests_total", "Requests by status code.", _ROUTE + ("status",)))
+IN_FLIGHT = register(Gauge(
+    "http_requests_in_flight", "Requests currently being handled.", _ROUTE))
+RESPONSE_SIZE = register(Histogram(
+    "http_response_size_bytes", "Response body size (non-streamed responses).", _ROUTE, SIZE_BUCKETS))
+
+
+def _route_labels():
+    rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+    return (request.blueprint or "", rule, request.method)
+
+
+def init_metrics(app):
+    """Register the request hooks and the /metrics endpoint."""
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_labels = _route_labels()
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc(g.metrics_labels)
+
+    @app.after_request
+    def _metrics_record(response):
+        labels = g.get("metrics_labels")
+        if labels is None:
+            return response
+        start = g.metrics_start
+        size = None if response.is_streamed else response.content_length
+
+        def record():
+            REQUEST_LATENCY.observe(labels, time.perf_counter() - start)
+            if size is not None:
+                RESPONSE_SIZE.observe(labels, size)
+
+        # streamed bodies (NDJSON listings) finish long after this hook
+        response.call_on_close(record)
+        REQUESTS.inc(labels + (str(response.status_code),))
+        return response
+
+    @app.teardown_request
+    def _metrics_done(exc):
+        labels = g.pop("metrics_labels", None)
+        if labels is not None:
+            IN_FLIGHT.dec(labels)
+
+    @app.get("/metrics")
+    def metrics():
+        token = current_app.config.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return jsonify(msg="forbidden"), 403
+        return Response(expose(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,90 @@
+"""
+Keyset (cursor) pagination on (created_at, _id) for the list endpoints.
+
+Without `cursor` / `limit` query params the endpoints keep returning the
+whole list as before. With them, at most `limit` items are returned plus a
+`next_cursor` to pass back for the following page (null on the last page).
+"""
+import base64
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import request, jsonify
+from streaming import wants_stream, ndjson_response
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def encode_cursor(doc):
+    raw = f'{doc["created_at"].isoformat()}|{doc["_id"]}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (created_at, _id) from an opaque cursor, ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, oid = raw.split("|", 1)
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
+
+
+def sort_spec(direction):
+    return [("created_at", direction), ("_id", direction)]
+
+
+def after(created_at, oid, direction):
+    """Filter matching documents strictly past (created_at, oid) in sort order."""
+    op = "$lt" if direction < 0 else "$gt"
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, "_id": {op: oid}},
+    ]}
+
+
+def page_args(args=None, decode=decode_cursor):
+    """
+    Parse `limit` / `cursor` from the query string (default: request.args).
+    Returns None when the request is not paginated, else (limit, position)
+    where position is None for the first page (otherwise decode(cursor)).
+    Raises ValueError on bad input.
+    """
+    args = request.args if args is None else args
+    if "cursor" not in args and "limit" not in args:
+        return None
+    try:
+        limit = int(args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    limit = max(1, min(limit, MAX_LIMIT))
+    cursor = args.get("cursor")
+    return limit, (decode(cursor) if cursor else None)
+
+
+def list_response(collection, query, key, serialize, direction=-1, streamable=False, fields=None):
+    """
+    JSON list response for `collection.find(query, fields)`, paginated when asked.
+    With streamable set, clients may also ask for NDJSON (see streaming.py);
+    `cursor` / `limit` then set the start position and the maximum count.
+    """
+    try:
+        page = page_args()
+    except ValueError as e:
+        return jsonify(msg=str(e)), 400
+
+    limit, position = page or (0, None)
+    if position:
+        query = {"$and": [query, after(*position, direction)]}
+    cursor = collection.find(query, fields).sort(sort_spec(direction))
+
+    if streamable and wants_stream():
+        return ndjson_response(cursor.limit(limit), serialize)
+
+    if page is None:
+        return jsonify({key: [serialize(d) for d in cursor]})
+
+    docs = list(cursor.limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return jsonify({key: [serialize(d) for d in docs[:limit]], "next_cursor": next_cursor})
@@ -0,0 +1,201 @@
+"""
+Serialization for API responses.
+
+- report / upload / voucher / user: the public shape of each Mongo document,
+  written as flat functions (bound lookups, no per-call url_for) because they
+  run once per row on every list endpoint. The matching *_FIELDS projections
+  make read-only queries fetch and decode only what is emitted (plus
+  created_at for pagination cursors).
+- JSONProvider: Flask JSON provider that knows ObjectId / datetime and
+  encodes with orjson when it is installed. Responses are sent as
+  MessagePack instead when the client's Accept header prefers it.
+
+`python bench/serialization.py` compares the per-document cost with the
+previous helpers.
+"""
+import json
+from datetime import datetime, date
+from urllib.parse import quote
+from bson import ObjectId
+from flask import request, url_for, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+# --------------------------
+# Documents
+# --------------------------
+
+REPORT_FIELDS = {
+    "user_id": 1, "username": 1, "project_name": 1, "species_choice": 1, "area_sqm": 1,
+    "trees_planned": 1, "lat": 1, "lon": 1, "status": 1, "result": 1, "created_at": 1,
+}
+UPLOAD_FIELDS = {"user_id": 1, "filename": 1, "status": 1, "points_awarded": 1, "created_at": 1}
+VOUCHER_FIELDS = {
+    "user_id": 1, "voucher_id": 1, "brand": 1, "value": 1, "code": 1, "status": 1, "created_at": 1,
+}
+USER_FIELDS = {"username": 1, "role": 1, "points": 1}
+
+
+def report(d):
+    """Compliance report document -> API dict"""
+    get = d.get
+    return {
+        "id": str(d["_id"]),
+        "user_id": str(d["user_id"]),
+        "username": get("username"),
+        "project_name": get("project_name"),
+        "species_choice": get("species_choice"),
+        "area_sqm": get("area_sqm"),
+        "trees_planned": get("trees_planned"),
+        "lat": get("lat"),
+        "lon": get("lon"),
+        "status": get("status", "Pending"),
+        "result": get("result", {}),
+    }
+
+
+# external URL prefix of serve_upload per request root; bounded because the
+# Host header is client controlled
+_UPLOAD_BASE = {}
+
+
+def upload_base():
+    """External URL prefix for /uploads/<filename> in the current request."""
+    root = request.url_root
+    base = _UPLOAD_BASE.get(root)
+    if base is None:
+        if len(_UPLOAD_BASE) > 32:
+            _UPLOAD_BASE.clear()
+        base = url_for("serve_upload", filename="_", _external=True)[:-1]
+        _UPLOAD_BASE[root] = base
+    return base
+
+
+def upload(d, base=None):
+    """Upload document -> API dict. `base` overrides upload_base() outside a request."""
+    get = d.get
+    filename = get("filename")
+    url = None
+    if filename:
+        url = (base or upload_base()) + quote(filename)
+    return {
+        "id": str(d["_id"]),
+        "user_id": str(d["user_id"]),
+        "filename": filename,
+        "status": get("status", "Pending"),
+        "points_awarded": int(get("points_awarded", 0)),
+        "url": url,
+    }
+
+
+def voucher(r):
+    """Voucher redemption document -> API dict"""
+    return {
+        "id": str(r["_id"]),
+        "user_id": str(r["user_id"]),
+        "voucher_id": r["voucher_id"],
+        "brand": r["brand"],
+        "value": int(r["value"]),
+        "code": r.get("code"),
+        "created_at": r["created_at"].isoformat() + "Z",
+        "status": r.get("status", "Issued"),
+    }
+
+
+def user(u):
+    """User document -> API dict (never includes the password hash)"""
+    return {
+        "id": str(u["_id"]),
+        "username": u.get("username"),
+        "role": u.get("role", "user"),
+        "points": int(u.get("points", 0)),
+    }
+
+
+# --------------------------
+# JSON / MessagePack provider
+# --------------------------
+
+def to_primitive(o):
+    """Fallback for types the encoders don't know: ObjectId, datetime, ..."""
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, datetime):
+        # stored datetimes are naive UTC
+        return o.isoformat() + "Z" if o.tzinfo is None else o.isoformat()
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+def response_mimetype(accept=None):
+    """
+    JSON, or a MessagePack type when the Accept header prefers it.
+    `accept` is a parsed MIMEAccept, by default the current Flask request's.
+    """
+    if msgpack is None:
+        return JSON
+    if accept is None:
+        if not has_request_context():
+            return JSON
+        accept = request.accept_mimetypes
+    # JSON listed first so that */* and ties keep JSON
+    best = accept.best_match((JSON,) + MSGPACK_TYPES)
+    return best if best in MSGPACK_TYPES else JSON
+
+
+def encode(obj, mimetype=JSON):
+    """Response body for obj in a mimetype from response_mimetype()."""
+    if mimetype != JSON:
+        return msgpack.packb(obj, default=to_primitive, use_bin_type=True)
+    if orjson is None:
+        return json.dumps(obj, default=to_primitive, separators=(",", ":")).encode()
+    return orjson.dumps(obj, default=to_primitive, option=_ORJSON_OPTS)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    app.json: orjson when available, otherwise Flask's default encoder.
+    response() (used by jsonify and dict returns) negotiates MessagePack.
+    """
+
+    default = staticmethod(to_primitive)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=to_primitive, option=_ORJSON_OPTS).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        mimetype = response_mimetype()
+        if mimetype == JSON and orjson is None:
+            resp = super().response(obj)
+        else:
+            body = encode(obj, mimetype)
+            resp = self._app.response_class(body + b"\n" if mimetype == JSON else body, mimetype=mimetype)
+        if msgpack is not None:
+            resp.vary.add("Accept")
+        return resp
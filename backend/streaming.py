@@ -0,0 +1,38 @@
+"""
+NDJSON streaming for large listings.
+
+Opt in with `Accept: application/x-ndjson` or `?stream=1`. Documents are
+encoded one per line as they come off the Mongo cursor, so memory stays flat
+and the first byte is sent as soon as the first batch arrives.
+"""
+from flask import Response, request, current_app, stream_with_context
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_stream(args=None, accept=None):
+    """Query args / parsed Accept header default to the current Flask request."""
+    args = request.args if args is None else args
+    accept = request.accept_mimetypes if accept is None else accept
+    if args.get("stream", "").lower() in ("1", "true"):
+        return True
+    # only an explicit mention counts; */* keeps the regular JSON response
+    return any(value == NDJSON and q > 0 for value, q in accept)
+
+
+def ndjson_response(cursor, serialize):
+    """Stream `serialize(doc)` for every doc of a pymongo cursor as NDJSON."""
+    cursor = cursor.batch_size(current_app.config["STREAM_BATCH_SIZE"])
+    dumps = current_app.json.dumps
+
+    def generate():
+        try:
+            for doc in cursor:
+                yield dumps(serialize(doc)) + "\n"
+        finally:
+            cursor.close()
+
+    resp = Response(stream_with_context(generate()), mimetype=NDJSON)
+    # let reverse proxies pass lines through instead of buffering the body
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
@@ -0,0 +1,240 @@
+"""
+Compliance summary PDF for government users: one table row per report
+(project, applicant, species, required vs planned trees, compliance and
+review status) and totals at the end, with the certificate's branding.
+
+ReportLab keeps a whole document in memory until save(), so pages are
+drawn with it one at a time (certificates.content_stream()) and written
+by StreamedPDF as soon as they are full. Memory does not grow with the
+number of reports, and the first bytes go out before the query finishes.
+"""
+import zlib
+from datetime import datetime
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from certificates import FONTS, BRAND, BRAND2, LINE, TEXT, content_stream
+
+# the report fields a summary row uses
+SUMMARY_FIELDS = {"project_name": 1, "username": 1, "species_choice": 1, "trees_planned": 1,
+                  "result": 1, "status": 1}
+
+# (heading, x, width, right aligned)
+COLUMNS = [
+    ("Project", 18*mm, 40*mm, False),
+    ("Applicant", 60*mm, 26*mm, False),
+    ("Species", 88*mm, 34*mm, False),
+    ("Required", 124*mm, 14*mm, True),
+    ("Planned", 140*mm, 14*mm, True),
+    ("Compliance", 158*mm, 18*mm, False),
+    ("Status", 178*mm, 14*mm, False),
+]
+ROW = 6*mm
+TOP = A4[1] - 62*mm      # baseline of the first row
+BOTTOM = 30*mm           # no row below this
+ROWS_PER_PAGE = int((TOP - BOTTOM) // ROW) + 1
+SIZE = 8.5
+
+
+class StreamedPDF:
+    """
+    Minimal PDF writer that outputs each page when it is added. Objects 1-4
+    are fixed (catalog, page tree, the two FONTS), so pages can point at
+    their parent before it is written; the page tree and cross-reference
+    table come last.
+    """
+    CATALOG, PAGES, FONT1, FONT2 = 1, 2, 3, 4
+
+    def __init__(self, title):
+        self.title = title
+        self.offsets = {}
+        self.kids = []
+        self.position = 0
+
+    def _object(self, num, body):
+        self.offsets[num] = self.position
+        data = b"%d 0 obj\n" % num + body + b"\nendobj\n"
+        self.position += len(data)
+        return data
+
+    def _next(self):
+        return max(self.offsets, default=self.FONT2) + 1
+
+    def start(self):
+        head = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.position = len(head)
+        fonts = [self._object(num, b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Name /F%d "
+                                   b"/Encoding /WinAnsiEncoding >>" % (name.encode(), i))
+                 for i, (num, name) in enumerate(zip((self.FONT1, self.FONT2), FONTS), 1)]
+        return head + b"".join(fonts)
+
+    def page(self, content):
+        """Bytes of a page with `content` (page operators, see content_stream())"""
+        data = zlib.compress(content.encode("latin-1"))
+        stream = self._next()
+        out = self._object(stream, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data)
+                           + data + b"\nendstream")
+        page = self._next()
+        self.kids.append(page)
+        return out + self._object(page, (
+            "<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.4f %.4f] /Contents %d 0 R "
+            "/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> /ProcSet [/PDF /Text] >> >>"
+            % (self.PAGES, A4[0], A4[1], stream, self.FONT1, self.FONT2)).encode())
+
+    def close(self):
+        """Page tree, catalog, info and cross-reference table"""
+        kids = " ".join(f"{k} 0 R" for k in self.kids)
+        out = self._object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.kids)} >>".encode())
+        out += self._object(self.CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % self.PAGES)
+        info = self._next()
+        title = self.title.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        out += self._object(info, f"<< /Title ({title}) /Producer (Verdantia) >>".encode("latin-1", "replace"))
+        size = info + 1
+        xref = b"xref\n0 %d\n0000000000 65535 f \n" % size
+        xref += b"".join(b"%010d 00000 n \n" % self.offsets[n] for n in range(1, size))
+        trailer = b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+            size, self.CATALOG, info, self.position)
+        return out + xref + trailer
+
+
+def fit(text, width, font="Helvetica", size=SIZE):
+    """`text` shortened with "..." to fit `width`"""
+    text = str(text or "")
+    full = stringWidth(text, font, size)
+    if full <= width:
+        return text
+    text = text[:int(len(text) * width / full)]
+    while text and stringWidth(text + "...", font, size) > width:
+        text = text[:-1]
+    return text + "..."
+
+
+def row_values(report):
+    result = report.get("result") or {}
+    delta = result.get("delta_trees", 0)
+    compliance = "Compliant" if result.get("compliant") else f"Short by {-delta}" if delta < 0 else "Non-compliant"
+    return [report.get("project_name", ""), report.get("username", ""), report.get("species_choice", ""),
+            result.get("required_trees", 0), report.get("trees_planned", 0), compliance,
+            report.get("status", "Pending")]
+
+
+def draw_frame(c, subtitle, number):
+    """Border, title, filter line, table header and footer of a page"""
+    W,H = A4
+    c.setStrokeColor(LINE)
+    c.setLineWidth(3)
+    c.rect(12*mm, 12*mm, W-24*mm, H-24*mm)
+
+    c.setFillColor(BRAND)
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(18*mm, H-30*mm, "Verdantia Compliance Summary")
+    c.setFillColor(BRAND2)
+    c.setFont("Helvetica", 11)
+    c.drawString(18*mm, H-37*mm, "AI-powered Afforestation Planner")
+    c.setFillColor(TEXT)
+    c.setFont("Helvetica", 9)
+    c.drawString(18*mm, H-44*mm, subtitle)
+
+    c.setFillColor(BRAND)
+    c.setFont("Helvetica-Bold", 9)
+    for heading, x, width, right in COLUMNS:
+        if right:
+            c.drawRightString(x + width, H-54*mm, heading)
+        else:
+            c.drawString(x, H-54*mm, heading)
+    c.setLineWidth(1)
+    c.line(18*mm, H-56*mm, W-18*mm, H-56*mm)
+
+    c.line(18*mm, 22*mm, W-18*mm, 22*mm)
+    c.setFillColor(BRAND2)
+    c.setFont("Helvetica", 8)
+    c.drawString(18*mm, 17*mm, "Issued by: Government Authority via Verdantia")
+    c.drawRightString(W-18*mm, 17*mm, f"Page {number}")
+
+
+def draw_rows(c, rows):
+    W,H = A4
+    y = TOP
+    for i, values in enumerate(rows):
+        if i % 2:
+            c.setFillColor(LINE)
+            c.rect(17*mm, y - 1.8*mm, W-34*mm, ROW, stroke=0, fill=1)
+        c.setFillColor(TEXT)
+        c.setFont("Helvetica", SIZE)
+        for (_, x, width, right), value in zip(COLUMNS, values):
+            if right:
+                c.drawRightString(x + width, y, str(value))
+            else:
+                c.drawString(x, y, fit(value, width))
+        y -= ROW
+    return y
+
+
+def draw_totals(c, y, totals):
+    W,H = A4
+    n = totals["reports"]
+    lines = [
+        f"Projects: {n}    Approved: {totals['approved']}    Pending: {n - totals['approved']}",
+        f"Compliant: {totals['compliant']} ({totals['compliant'] * 100 // n if n else 0}%)    "
+        f"Required trees: {totals['required']}    Planned trees: {totals['planned']}",
+    ]
+    c.setStrokeColor(BRAND2)
+    c.setLineWidth(1)
+    c.line(18*mm, y, W-18*mm, y)
+    c.setFillColor(BRAND)
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(18*mm, y - 7*mm, "Totals")
+    c.setFillColor(TEXT)
+    c.setFont("Helvetica", 10)
+    for i, text in enumerate(lines):
+        c.drawString(18*mm, y - (14 + 6*i)*mm, text)
+
+
+def describe(status=None, since=None, until=None, user=None):
+    """Filter line under the title, from certificates.export_filter() arguments"""
+    parts = [f"{status} reports" if status else "All reports"]
+    if since:
+        parts.append(f"from {since}")
+    if until:
+        parts.append(f"until {until} (exclusive)")
+    if user:
+        parts.append(f"user {user}")
+    return " · ".join(parts)
+
+
+def summary_pdf(reports, subtitle, title="Verdantia Compliance Summary"):
+    """
+    Yield the summary PDF of `reports` (an iterable, e.g. a cursor with
+    SUMMARY_FIELDS) page by page.
+    """
+    pdf = StreamedPDF(title)
+    subtitle = f"{subtitle} · generated {datetime.utcnow():%Y-%m-%d %H:%M} UTC"
+    totals = {"reports": 0, "approved": 0, "compliant": 0, "required": 0, "planned": 0}
+    yield pdf.start()
+
+    def page(rows, last=False):
+        def draw(c):
+            draw_frame(c, subtitle, len(pdf.kids) + 1)
+            y = draw_rows(c, rows)
+            if last:
+                draw_totals(c, y - 2*mm, totals)
+        return pdf.page(content_stream(draw))
+
+    rows = []
+    for report in reports:
+        values = row_values(report)
+        totals["reports"] += 1
+        totals["approved"] += values[6] == "Approved"
+        totals["compliant"] += values[5] == "Compliant"
+        totals["required"] += int(values[3] or 0)
+        totals["planned"] += int(values[4] or 0)
+        rows.append(values)
+        if len(rows) == ROWS_PER_PAGE:
+            yield page(rows)
+            rows = []
+    # the totals need about five rows of space
+    if len(rows) > ROWS_PER_PAGE - 5:
+        yield page(rows)
+        rows = []
+    yield page(rows, last=True)
+    yield pdf.close()
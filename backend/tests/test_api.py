@@ -0,0 +1,178 @@
+"""
+The Flask app (app.py) and the ASGI app (asgi.py) against a local mongod:
+the same requests get the same statuses and payloads from both, and a
+token issued by either is accepted by the other.
+
+    pip install -r requirements-asgi.txt pytest httpx
+    cd backend && MONGO_URI=mongodb://localhost:27017 python -m pytest tests
+
+Each run works in a database of its own, dropped afterwards. Skipped when
+no mongod answers at MONGO_URI.
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = f"verdantia_test_{uuid.uuid4().hex[:8]}"
+
+try:
+    _client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000)
+    _client.admin.command("ping")
+except PyMongoError:
+    pytest.skip(f"no mongod at {MONGO_URI}", allow_module_level=True)
+
+_files = tempfile.mkdtemp(prefix="verdantia-test-")
+os.environ.update(
+    MONGO_URI=MONGO_URI,
+    MONGO_DB=DB_NAME,
+    MONGO_LAZY_CONNECT="false",
+    UPLOAD_DIR=os.path.join(_files, "uploads"),
+    CERT_DIR=os.path.join(_files, "certs"),
+    LEDGER_COMPACT_INTERVAL="3600",
+)
+
+import ledger  # noqa: E402
+
+
+class Api:
+    """Flask test client and Starlette TestClient behind one interface."""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+
+    def request(self, method, path, token=None, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        r = getattr(self.client, method)(path, headers=headers, **kwargs)
+        body = r.get_json() if self.name == "flask" else r.json()
+        return r.status_code, body
+
+    def user(self, role="user"):
+        """(token, user id) of a new account"""
+        username = f"{self.name}-{uuid.uuid4().hex[:8]}"
+        status, _ = self.request("post", "/api/auth/register",
+                                 json={"username": username, "password": "pw", "role": role})
+        assert status == 201
+        _, body = self.request("post", "/api/auth/login", json={"username": username, "password": "pw"})
+        return body["token"], body["user"]["id"]
+
+    def upload(self, token, filename, content):
+        if self.name == "flask":
+            files = {"data": {"file": (io.BytesIO(content), filename)}, "content_type": "multipart/form-data"}
+        else:
+            files = {"files": {"file": (filename, io.BytesIO(content))}}
+        return self.request("post", "/api/upload-video", token, **files)
+
+
+@pytest.fixture(scope="module")
+def db():
+    yield _client[DB_NAME]
+    _client.drop_database(DB_NAME)
+    shutil.rmtree(_files, ignore_errors=True)
+
+
+@pytest.fixture(scope="module")
+def flask_api(db):
+    from app import app
+
+    app.ledger.stop()
+    return Api("flask", app.test_client())
+
+
+@pytest.fixture(scope="module")
+def asgi_api(db):
+    from starlette.testclient import TestClient
+    import asgi
+
+    with TestClient(asgi.app) as client:
+        yield Api("asgi", client)
+
+
+@pytest.fixture(params=["flask", "asgi"])
+def api(request):
+    return request.getfixturevalue(f"{request.param}_api")
+
+
+def test_health(api):
+    assert api.request("get", "/health/ready") == (200, {"ok": True, "db": "up"})
+
+
+def test_register_login_me(api):
+    token, uid = api.user()
+    status, body = api.request("get", "/api/auth/me", token)
+    assert status == 200
+    assert body["user"]["id"] == uid and body["user"]["points"] == 0
+    assert api.request("post", "/api/auth/login", json={"username": "nobody", "password": "x"}) == \
+        (401, {"msg": "invalid credentials"})
+
+
+def test_tokens_accepted_by_both(flask_api, asgi_api):
+    for issuer, other in ((flask_api, asgi_api), (asgi_api, flask_api)):
+        token, uid = issuer.user()
+        status, body = other.request("get", "/api/auth/me", token)
+        assert status == 200 and body["user"]["id"] == uid
+
+
+@pytest.mark.parametrize("method, path, kwargs", [
+    ("delete", "/api/compliance-report/zz", {}),
+    ("put", "/api/compliance-approve/zz", {}),
+    ("put", "/api/upload-approve/zz", {}),
+    ("get", "/api/leaderboard?period=year", {}),
+    ("get", "/api/leaderboard/me?around=x", {}),
+    ("post", "/api/redeem-voucher", {"json": {"voucher_id": "V0"}}),
+    ("post", "/api/redeem-voucher", {"json": {"voucher_id": "V50"}}),
+    ("get", "/api/sync?since=not-a-token", {}),
+    ("post", "/api/batch", {"json": {"requests": []}}),
+])
+def test_errors_match(flask_api, asgi_api, method, path, kwargs):
+    # government accounts may call every route above
+    results = [api.request(method, path, api.user("government")[0], **kwargs) for api in (flask_api, asgi_api)]
+    assert results[0] == results[1]
+    assert results[0][0] >= 400
+
+
+def test_upload_approve_redeem(api, db):
+    token, uid = api.user()
+    gov, _ = api.user("government")
+    status, body = api.upload(token, "a.mp4", b"x")
+    assert status == 200
+    upload_id = body["id"]
+    for _ in range(2):
+        assert api.request("put", f"/api/upload-approve/{upload_id}", gov) == (200, {"ok": True})
+    # awarded, and counted on the weekly board, once
+    assert db.points_ledger.count_documents({"_id": ledger.approve_key(ObjectId(upload_id))}) == 1
+    assert db.points_windows.find_one({"user_id": ObjectId(uid), "period": "week"})["points"] == 50
+
+    # the pending award is folded in before the balance check
+    retry = {"Idempotency-Key": "k1"}
+    status, first = api.request("post", "/api/redeem-voucher", token, headers=retry, json={"voucher_id": "V50"})
+    assert status == 200 and first["ok"]
+    assert api.request("post", "/api/redeem-voucher", token, headers=retry, json={"voucher_id": "V50"}) == (200, first)
+    assert api.request("post", "/api/redeem-voucher", token, json={"voucher_id": "V50"}) == \
+        (400, {"error": "insufficient points"})
+    assert api.request("get", "/api/auth/me", token)[1]["user"]["points"] == 0
+    assert ledger.verify(db) == []
+
+
+def test_dashboard_and_sync(flask_api, asgi_api):
+    keys = []
+    for api in (flask_api, asgi_api):
+        token, _ = api.user()
+        dash = api.request("get", "/api/dashboard", token)
+        sync = api.request("get", "/api/sync", token)
+        assert dash[0] == 200 and sync[0] == 200
+        keys.append((sorted(dash[1]), sorted(sync[1])))
+    assert keys[0] == keys[1]
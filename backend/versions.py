@@ -0,0 +1,99 @@
+"""
+Conditional GET (ETag / Last-Modified / 304) for the read endpoints.
+
+Every listing has a version counter in the `versions` collection, keyed by
+collection and owner ("reports:<user id>", "uploads:pending", "users:all"
+for the leaderboards, ...). Writes bump the counters of the listings they
+change, after the write. A GET reads its counters with one _id lookup,
+derives the ETag from them and the request (path, query, Accept), and
+answers 304 before running the listing query when the client already has
+that version. The body is never hashed.
+
+Responses are sent with `Cache-Control: private, no-cache`, so browsers keep
+them and revalidate on every poll.
+"""
+import hashlib
+from datetime import datetime, timezone
+from flask import request, current_app
+from pymongo import UpdateOne
+from werkzeug.http import parse_etags, parse_date, quote_etag, http_date
+
+VARY = ("Accept", "Authorization")
+
+
+def key(collection, owner="all"):
+    """Version key of the `collection` rows of one owner (a user id, "pending", "all")."""
+    return f"{collection}:{owner}"
+
+
+def bump_ops(keys):
+    now = datetime.utcnow()
+    return [UpdateOne({"_id": k}, {"$inc": {"v": 1}, "$set": {"at": now}}, upsert=True) for k in keys]
+
+
+def bump(db, *keys):
+    """Mark the listings under `keys` as changed; call after the write."""
+    db.versions.bulk_write(bump_ops(keys), ordered=False)
+
+
+def state(docs, keys, since=None):
+    """
+    (token, last modified) from the versions documents of `keys`; `since`
+    is a lower bound for last modified.
+    """
+    found = {d["_id"]: d for d in docs}
+    # `at` in the token keeps it unique if the collection is ever reset
+    token = ";".join(f'{k}={found[k]["v"]}@{found[k]["at"].isoformat()}' if k in found else f"{k}=0"
+                     for k in keys)
+    times = [d["at"] for d in found.values()] + ([since] if since else [])
+    return token, (max(times).replace(tzinfo=timezone.utc) if times else None)
+
+
+def read(db, keys, since=None):
+    return state(db.versions.find({"_id": {"$in": list(keys)}}), keys, since)
+
+
+def etag(token, path, query, accept):
+    raw = "|".join((token, path, query, accept or ""))
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def not_modified(if_none_match, if_modified_since, tag, last_modified):
+    """True when the client's validators match; If-None-Match wins over If-Modified-Since."""
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(tag)
+    if if_modified_since and last_modified:
+        since = parse_date(if_modified_since)
+        return since is not None and last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def validators(tag, last_modified):
+    headers = {"ETag": quote_etag(tag, weak=True), "Cache-Control": "private, no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def conditional(keys, build, variant="", since=None):
+    """
+    304 if the client has the current version of the listings under `keys`,
+    else build() with validators. `variant` is mixed into the ETag for state
+    the counters do not cover; `since` is a lower bound for Last-Modified.
+    """
+    token, last_modified = read(current_app.db, keys, since)
+    return conditional_response(f"{token}|{variant}", last_modified, build)
+
+
+def conditional_response(token, last_modified, build):
+    tag = etag(token, request.path, request.query_string.decode(), request.headers.get("Accept"))
+    if not_modified(request.headers.get("If-None-Match"), request.headers.get("If-Modified-Since"),
+                    tag, last_modified):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.make_response(build())
+        if resp.status_code != 200:
+            return resp
+    resp.headers.update(validators(tag, last_modified))
+    resp.vary.update(VARY)
+    return resp
@@ -0,0 +1,79 @@
+"""
+Per-process thread pools for fanning out work inside a request.
+
+Pools are created on first use in each process: threads do not survive
+gunicorn's fork, so a pool created in the preloading master would be dead
+in the workers. Size comes from app.config[config_key].
+
+Use a separate pool per caller that can nest (a batched /api/dashboard
+waiting on its own pool could otherwise deadlock).
+
+LocalProcessPool is the same for CPU-bound work (certificate rendering)
+that should use more than one core.
+"""
+import contextvars
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+
+
+class LocalPool:
+    def __init__(self, name, config_key):
+        self.name = name
+        self.config_key = config_key
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=current_app.config[self.config_key],
+                                                thread_name_prefix=self.name)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, fn, *args):
+        """Run fn in a copy of the caller's context (request, g, current_app stay available)."""
+        return self._executor().submit(contextvars.copy_context().run, fn, *args)
+
+
+class LocalProcessPool:
+    """
+    Worker processes, started lazily like LocalPool. They are spawned, not
+    forked: a forked child would inherit the locks of the web worker's
+    threads (Mongo monitors, pools) in whatever state they were. fn and its
+    arguments must be picklable and cannot use the app context. A spawned
+    worker re-runs the main script as __mp_main__, so scripts that start
+    processes must not build the app there (see the end of app.py).
+    """
+
+    def __init__(self, config_key):
+        self.config_key = config_key
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return current_app.config[self.config_key]
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.size,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, fn, *args):
+        try:
+            return self._executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # a worker died (e.g. OOM-killed): start a new pool
+            with self._lock:
+                self._pool = None
+            return self._executor().submit(fn, *args)
@@ -1,6 +1,6 @@
 import React from 'react'
 import { useNavigate } from 'react-router-dom'
-import { api, authDownload } from '../services/api.js'
+import { api, authDownload, streamDownload } from '../services/api.js'
 import MapPicker from '../components/MapPicker.jsx'
 import { Icons } from '../components/Icons.jsx'
 
@@ -54,6 +54,9 @@ export default function Dashboard(){
   const [isSubmitting,setIsSubmitting]=React.useState(false)
   const [currentStep,setCurrentStep]=React.useState(1)
   const fileInputRef = React.useRef(null)
+  const syncToken = React.useRef(null)
+  const [exportFilter,setExportFilter]=React.useState({status:'Approved', from:'', to:'', user:''})
+  const exportQuery = () => new URLSearchParams(Object.entries(exportFilter).filter(([,v])=>v))
 
   const roleIsUser = (user && user.role !== 'government')
   const displayRole = roleIsUser ? 'user' : 'government'
@@ -65,28 +68,54 @@ export default function Dashboard(){
 
   React.useEffect(()=>{ if(!token){ nav('/login'); return } refreshAll() },[]) // eslint-disable-line react-hooks/exhaustive-deps
 
+  // first call: full lists; after that only what changed since syncToken
   async function refreshAll(){
     try{
       setErr('')
-      const me = await api('/api/auth/me', {token})
-      sessionStorage.setItem('user', JSON.stringify(me.user))
-      setUser(me.user)
-      if(me.user.role !== 'government'){
-        const rep=await api('/api/compliance-reports',{token})
-        setReports(rep.reports||[])
-        const my=await api('/api/my-videos',{token})
-        setUploads(my.videos||[])
-      } else {
-        const p=await api('/api/admin/compliance-pending',{token})
-        setPendingComp(p.reports||[])
-        const u=await api('/api/admin/uploads-pending',{token})
-        setPendingUploads(u.uploads||[])
-      }
-      const lb=await api('/api/leaderboard')
-      setLeader(lb.leaderboard||[])
+      applySync(await api(syncPath(), {token}))
     }catch(e){ setErr(e.message) }
   }
 
+  function syncPath(){
+    return '/api/sync' + (syncToken.current ? '?since=' + encodeURIComponent(syncToken.current) : '')
+  }
+
+  // upsert changed rows by id and drop removed ones; new rows go to the
+  // top of newest-first lists and the bottom of the oldest-first queues
+  function merge(list, changed=[], removed=[], newestFirst){
+    const gone = new Set(removed)
+    const byId = new Map(changed.map(d => [d.id, d]))
+    const kept = list.filter(d => !gone.has(d.id)).map(d => byId.get(d.id) || d)
+    const known = new Set(list.map(d => d.id))
+    const added = changed.filter(d => !known.has(d.id))
+    return newestFirst ? [...added, ...kept] : [...kept, ...added]
+  }
+
+  function applySync(d){
+    sessionStorage.setItem('user', JSON.stringify(d.user))
+    setUser(d.user)
+    const apply = (set, key, newestFirst) =>
+      set(list => d.full ? (d[key]||[]) : merge(list, d[key], (d.removed||{})[key], newestFirst))
+    if(d.user.role !== 'government'){
+      apply(setReports, 'reports', true)
+      apply(setUploads, 'videos', true)
+    } else {
+      apply(setPendingComp, 'pending_reports', false)
+      apply(setPendingUploads, 'pending_uploads', false)
+    }
+    setLeader(d.leaderboard||[])
+    syncToken.current = d.token
+  }
+
+  // write + sync in one round trip
+  async function actThenRefresh(path, method){
+    const { responses:[act, changes] } = await api('/api/batch', { method:'POST', token, body:{ requests:[
+      { method, path }, { method:'GET', path:syncPath() }
+    ] } })
+    if(act.status >= 400) throw new Error((act.body && (act.body.msg || act.body.error)) || 'Request failed')
+    applySync(changes.body)
+  }
+
   async function getReco(){
     try{
       setErr('')
@@ -174,12 +203,12 @@ export default function Dashboard(){
   }
 
   async function approveReport(id){
-    try{ await api(`/api/compliance-approve/${id}`,{method:'PUT', token}); await refreshAll() }
+    try{ await actThenRefresh(`/api/compliance-approve/${id}`, 'PUT') }
     catch(e){ setErr(e.message) }
   }
 
   async function approveUpload(id){
-    try{ await api(`/api/upload-approve/${id}`,{method:'PUT', token}); await refreshAll() }
+    try{ await actThenRefresh(`/api/upload-approve/${id}`, 'PUT') }
     catch(e){ setErr(e.message) }
   }
 
@@ -663,6 +692,27 @@ export default function Dashboard(){
           </div>
         </div>
 
+        <div className='card section'>
+          <h4><Icons.File width={18} height={18}/> Export Certificates</h4>
+          <p className='subtle'>Download the certificates of every matching project as one ZIP, or a summary table of them as a PDF. Dates are approval dates for approved projects; "To" is exclusive.</p>
+          <div style={{display:'flex', gap:12, flexWrap:'wrap', alignItems:'end'}}>
+            <label>Status<br/>
+              <select value={exportFilter.status} onChange={e=>setExportFilter({...exportFilter, status:e.target.value})}>
+                <option>Approved</option><option>Pending</option>
+              </select>
+            </label>
+            <label>From<br/><input type='date' value={exportFilter.from} onChange={e=>setExportFilter({...exportFilter, from:e.target.value})}/></label>
+            <label>To<br/><input type='date' value={exportFilter.to} onChange={e=>setExportFilter({...exportFilter, to:e.target.value})}/></label>
+            <label>Username<br/><input value={exportFilter.user} onChange={e=>setExportFilter({...exportFilter, user:e.target.value})}/></label>
+            <button onClick={()=>streamDownload('/api/admin/certificates-export?' + exportQuery())}>
+              <Icons.File width={14} height={14}/> Download ZIP
+            </button>
+            <button onClick={()=>streamDownload('/api/admin/compliance-summary?' + exportQuery())}>
+              <Icons.File width={14} height={14}/> Summary PDF
+            </button>
+          </div>
+        </div>
+
         <div className='card section'>
           <h4><Icons.Plant width={18} height={18}/> Proof Moderation</h4>
           <p className='subtle'>Approve valid uploads only. Approval credits +50 points automatically.</p>
@@ -28,8 +28,13 @@ export async function api(path, {method='GET', token, body, formData}={}){
 export async function authDownload(path){
   const token = sessionStorage.getItem('token')
   try{
-    const res = await fetch(BASE + path, { headers: { 'Authorization': 'Bearer '+token } })
-    if(res.ok){
+    let res = await fetch(BASE + path, { headers: { 'Authorization': 'Bearer '+token } })
+    // 202: still being generated on the server
+    for(let tries = 0; res.status === 202 && tries < 5; tries++){
+      await new Promise(r => setTimeout(r, 1000 * (Number(res.headers.get('Retry-After')) || 1)))
+      res = await fetch(BASE + path, { headers: { 'Authorization': 'Bearer '+token } })
+    }
+    if(res.ok && res.status !== 202){
       const blob = await res.blob()
       const a = document.createElement('a')
       a.href = URL.createObjectURL(blob)
@@ -40,3 +45,10 @@ export async function authDownload(path){
   }catch{}
   window.open(BASE + path + '?token=' + encodeURIComponent(token), '_blank')
 }
+
+// large streamed files: the browser saves the body as it arrives instead of buffering a blob
+export function streamDownload(path){
+  const token = sessionStorage.getItem('token')
+  const sep = path.includes('?') ? '&' : '?'
+  window.location.href = BASE + path + sep + 'token=' + encodeURIComponent(token)
+}